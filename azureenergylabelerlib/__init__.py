@@ -52,7 +52,8 @@ from .configuration import (TENANT_THRESHOLDS,
                             FINDING_FILTERING_STATES
                             )
 
-from .entities import Subscription, DataExporter
+from .entities import Subscription
+from .exporters import DataExporter
 from .validations import (validate_subscription_ids,
                           are_valid_subscription_ids,
                           is_valid_subscription_id,
@@ -71,39 +72,33 @@ __maintainer__ = '''Sayantan Khanra'''
 __email__ = '''<skhanra@schubergphilis.com>'''
 __status__ = '''Development'''  # "Prototype", "Development", "Production".
 
-# This is to 'use' the module(s), so lint doesn't complain
-assert __version__
-
-assert AzureEnergyLabeler
-assert Tenant
-assert DefenderForCloud
-
-assert InvalidFrameworks
-assert InvalidSubscriptionListProvided
-assert MutuallyExclusiveArguments
-assert SubscriptionNotPartOfTenant
-
-assert TENANT_THRESHOLDS
-assert SUBSCRIPTION_THRESHOLDS
-assert RESOURCE_GROUP_THRESHOLDS
-assert DEFAULT_DEFENDER_FOR_CLOUD_FRAMEWORKS
-assert FILE_EXPORT_TYPES
-assert DATA_EXPORT_TYPES
-assert ALL_TENANT_EXPORT_TYPES
-assert ALL_SUBSCRIPTION_EXPORT_DATA
-assert TENANT_METRIC_EXPORT_TYPES
-assert SUBSCRIPTION_METRIC_EXPORT_TYPES
-assert RESOURCE_GROUP_METRIC_EXPORT_TYPES
-assert FINDING_FILTERING_STATES
-
-assert Subscription
-assert DataExporter
-
-assert validate_subscription_ids
-assert are_valid_subscription_ids
-assert validate_allowed_denied_subscription_ids
-assert is_valid_subscription_id
-assert validate_resource_group_names
-assert are_valid_resource_group_names
-assert is_valid_resource_group_name
-assert DestinationPath
+__all__ = ['__version__',
+           'AzureEnergyLabeler',
+           'Tenant',
+           'DefenderForCloud',
+           'InvalidFrameworks',
+           'InvalidSubscriptionListProvided',
+           'MutuallyExclusiveArguments',
+           'SubscriptionNotPartOfTenant',
+           'TENANT_THRESHOLDS',
+           'SUBSCRIPTION_THRESHOLDS',
+           'RESOURCE_GROUP_THRESHOLDS',
+           'DEFAULT_DEFENDER_FOR_CLOUD_FRAMEWORKS',
+           'FILE_EXPORT_TYPES',
+           'DATA_EXPORT_TYPES',
+           'ALL_TENANT_EXPORT_TYPES',
+           'ALL_SUBSCRIPTION_EXPORT_DATA',
+           'TENANT_METRIC_EXPORT_TYPES',
+           'SUBSCRIPTION_METRIC_EXPORT_TYPES',
+           'RESOURCE_GROUP_METRIC_EXPORT_TYPES',
+           'FINDING_FILTERING_STATES',
+           'Subscription',
+           'DataExporter',
+           'validate_subscription_ids',
+           'are_valid_subscription_ids',
+           'validate_allowed_denied_subscription_ids',
+           'is_valid_subscription_id',
+           'validate_resource_group_names',
+           'are_valid_resource_group_names',
+           'is_valid_resource_group_name',
+           'DestinationPath']
@@ -31,11 +31,8 @@ Main code for azureenergylabelerlib.
 
 """
 import logging
-from cachetools import cached, TTLCache
+import time
 
-from azure.core.exceptions import ClientAuthenticationError
-from azure.identity import DefaultAzureCredential
-from azure.mgmt.resource import SubscriptionClient
 
 from azureenergylabelerlib.validations import validate_resource_group_names
 from .azureenergylabelerlibexceptions import InvalidCredentials
@@ -43,8 +40,14 @@ from .configuration import (TENANT_THRESHOLDS,
                             RESOURCE_GROUP_THRESHOLDS,
                             SUBSCRIPTION_THRESHOLDS,
                             DEFAULT_DEFENDER_FOR_CLOUD_FRAMEWORKS,
-                            FINDING_FILTERING_STATES)
+                            FINDING_FILTERING_STATES,
+                            FINDINGS_CACHE_TTL,
+                            FINDINGS_IN_MEMORY_CACHE_TTL,
+                            RESOURCE_GRAPH_MAX_CONCURRENT_QUERIES)
+from .cache import FindingsDiskCache
+from .datamodels import SUBSCRIPTIONS_DATA_MAX_WORKERS
 from .entities import DefenderForCloud, Tenant, FindingParserLabeler
+from .utils import normalize_name
 from .schemas import (resource_group_thresholds_schema,
                       subscription_thresholds_schema,
                       tenant_thresholds_schema)
@@ -100,6 +103,9 @@ class AzureEnergyLabeler:  # pylint: disable=too-many-arguments
         Exclude list of subscriptions to be evaluated
     denied_resource_group_names : List
         List of resource group names to be excluded
+    findings_cache_ttl : int
+        Seconds the retrieved findings are cached on disk across runs, 0 disables the cache which is the default.
+        Defaults to :data:`~azureenergylabelerlib.configuration.FINDINGS_CACHE_TTL`
 
     """
 
@@ -113,65 +119,139 @@ class AzureEnergyLabeler:  # pylint: disable=too-many-arguments
                  credentials=None,
                  allowed_subscription_ids=None,
                  denied_subscription_ids=None,
-                 denied_resource_group_names=None):
+                 denied_resource_group_names=None,
+                 findings_cache_ttl=FINDINGS_CACHE_TTL):
         self._logger = logging.getLogger(f'{LOGGER_BASENAME}.{self.__class__.__name__}')
         self._tenant_id = tenant_id
         self.resource_group_thresholds = resource_group_thresholds_schema.validate(resource_group_thresholds)
         self.tenant_thresholds = tenant_thresholds_schema.validate(tenant_thresholds)
         self.subscription_thresholds = subscription_thresholds_schema.validate(subscription_thresholds)
-        self.tenant_credentials = self._fetch_credentials(credentials)
+        self._credentials = credentials
+        self._tenant_credentials = None
         self.allowed_subscription_ids = allowed_subscription_ids
         self.denied_subscription_ids = denied_subscription_ids
-        self.denied_resource_group_names = validate_resource_group_names(denied_resource_group_names)
-        self._tenant = Tenant(credential=self.tenant_credentials,
-                              tenant_id=self._tenant_id,
-                              thresholds=self.tenant_thresholds,
-                              subscription_thresholds=self.subscription_thresholds,
-                              resource_group_thresholds=self.resource_group_thresholds,
-                              allowed_subscription_ids=self.allowed_subscription_ids,
-                              denied_subscription_ids=self.denied_subscription_ids,
-                              denied_resource_group_names=self.denied_resource_group_names)
-        self._defender_for_cloud = self._initialize_defender_for_cloud(credential=self.tenant_credentials)
+        self.denied_resource_group_names = tuple(normalize_name(resource_group_name) for resource_group_name in
+                                                 validate_resource_group_names(denied_resource_group_names))
+        self._transport = None
+        self._tenant = None
+        self._defender_for_cloud = None
         self._frameworks = DefenderForCloud.validate_frameworks(frameworks)
+        self._findings_cache = FindingsDiskCache(ttl=findings_cache_ttl)
+        self._defender_for_cloud_findings = None
+        self._defender_for_cloud_findings_expiry = None
         self._tenant_energy_label = None
         self._labeled_subscriptions_energy_label = None
         self._tenant_labeled_subscriptions = None
 
-    def _fetch_credentials(self, credentials=None):
-        credentials = credentials if credentials else DefaultAzureCredential()
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Closes the connections the Azure clients of the labeler have open."""
+        if self._transport is not None:
+            self._transport.close()
+
+    @staticmethod
+    def _fetch_credentials(credentials=None):
+        if credentials:
+            return credentials
+        from azure.identity import DefaultAzureCredential  # pylint: disable=import-outside-toplevel
+        return DefaultAzureCredential()
+
+    @property
+    def _shared_transport(self):
+        """A single http transport shared by all the Azure clients of the labeler.
+
+        The connection pool of the session is sized to the most requests the labeler makes concurrently, so no worker
+        has its connection discarded for exceeding the default pool of ten connections. The transport owns the session,
+        which is closed along with the labeler.
+
+        """
+        if self._transport is None:
+            import requests  # pylint: disable=import-outside-toplevel
+            from azure.core.pipeline.transport import RequestsTransport  # pylint: disable=import-outside-toplevel,no-name-in-module
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(SUBSCRIPTIONS_DATA_MAX_WORKERS,
+                                                                     RESOURCE_GRAPH_MAX_CONCURRENT_QUERIES))
+            for protocol in ('https://', 'http://'):
+                session.mount(protocol, adapter)
+            self._transport = RequestsTransport(session=session, session_owner=True)
+        return self._transport
+
+    @property
+    def tenant_credentials(self):
+        """The credentials used to access the Azure API."""
+        if self._tenant_credentials is None:
+            self._tenant_credentials = self._fetch_credentials(self._credentials)
+        return self._tenant_credentials
+
+    def _initialize_tenant(self):
+        """Initialize the tenant.
+
+        Listing the subscriptions of the tenant is the first call to Azure, so it also validates the credentials,
+        saving a dedicated subscription listing round trip just for that.
+
+        """
+        from azure.core.exceptions import ClientAuthenticationError  # pylint: disable=import-outside-toplevel
         try:
-            subscription_client = SubscriptionClient(credentials)
-            subscriptions = [subscription.display_name for subscription in subscription_client.subscriptions.list()]
-            self._logger.info(f'Credentials valid for: {subscriptions}')
+            tenant = Tenant(credential=self.tenant_credentials,
+                            tenant_id=self._tenant_id,
+                            thresholds=self.tenant_thresholds,
+                            subscription_thresholds=self.subscription_thresholds,
+                            resource_group_thresholds=self.resource_group_thresholds,
+                            allowed_subscription_ids=self.allowed_subscription_ids,
+                            denied_subscription_ids=self.denied_subscription_ids,
+                            denied_resource_group_names=self.denied_resource_group_names,
+                            transport=self._shared_transport)
         except ClientAuthenticationError as error:
             raise InvalidCredentials(error) from None
-
-        return credentials
+        subscriptions = [subscription.display_name for subscription in tenant.subscriptions]
+        self._logger.info(f'Credentials valid for: {subscriptions}')
+        return tenant
 
     def _initialize_defender_for_cloud(self, credential):
         """Initialize defender for cloud."""
         subscription_list = [subscription.subscription_id for subscription in
-                             self._tenant.subscriptions]
-        return DefenderForCloud(credential, subscription_list)
+                             self.tenant.subscriptions]
+        return DefenderForCloud(credential, subscription_list, self.denied_resource_group_names,
+                                self._shared_transport)
 
     @property
-    @cached(cache=TTLCache(maxsize=150000, ttl=120))
     def defender_for_cloud_findings(self):
         """Defender for cloud findings.
 
-        The self.denied_resource_group_names is turned into lowercase since the,
-        <azure.mgmt.resourcegraph.models._models_py3.QueryResponse object has the resource group in lowercase.
+        The findings of the self.denied_resource_group_names are excluded by the resource graph query itself so they
+        are never transferred.
+
+        The findings are kept on the instance for two minutes and, when a findings cache ttl is set, are also cached on
+        disk so subsequent runs for the same tenant, frameworks, subscriptions and denied resource groups do not need
+        to retrieve them again.
 
         """
-        filtered_findings = [finding for finding in self._defender_for_cloud.get_findings(frameworks=self._frameworks)
-                             if finding.resource_group not in [rg.lower() for rg in self.denied_resource_group_names]]
-        return filtered_findings
+        now = time.monotonic()
+        if self._defender_for_cloud_findings_expiry is None or now > self._defender_for_cloud_findings_expiry:
+            self._defender_for_cloud_findings = self._retrieve_defender_for_cloud_findings()
+            self._defender_for_cloud_findings_expiry = now + FINDINGS_IN_MEMORY_CACHE_TTL
+        return self._defender_for_cloud_findings
+
+    def _retrieve_defender_for_cloud_findings(self):
+        cache_key = FindingsDiskCache.get_key(self._tenant_id,
+                                              self._frameworks,
+                                              self.defender_for_cloud.subscription_list,
+                                              self.denied_resource_group_names)
+        findings = self._findings_cache.get(cache_key)
+        if findings is None:
+            findings = self.defender_for_cloud.get_findings(frameworks=self._frameworks)
+            self._findings_cache.set(cache_key, findings)
+        return tuple(findings)
 
     @property
     def filtered_defender_for_cloud_findings(self):
         """Filtered defender for cloud findings."""
-        not_skipped_findings = FindingParserLabeler.get_not_skipped_findings(self.defender_for_cloud_findings)
-        return FindingParserLabeler.exclude_findings_by_state(not_skipped_findings, FINDING_FILTERING_STATES)
+        return FindingParserLabeler.filter_findings(self.defender_for_cloud_findings, FINDING_FILTERING_STATES)
 
     @property
     def matching_frameworks(self):
@@ -181,26 +261,30 @@ class AzureEnergyLabeler:  # pylint: disable=too-many-arguments
     @property
     def defender_for_cloud(self):
         """Defender for cloud."""
+        if self._defender_for_cloud is None:
+            self._defender_for_cloud = self._initialize_defender_for_cloud(credential=self.tenant_credentials)
         return self._defender_for_cloud
 
     @property
     def tenant(self):
         """Tenant."""
+        if self._tenant is None:
+            self._tenant = self._initialize_tenant()
         return self._tenant
 
     @property
     def tenant_energy_label(self):
         """Energy label of the Azure Tenant."""
         if self._tenant_energy_label is None:
-            self._logger.debug(f'Tenant subscriptions labeled are {len(self._tenant.subscriptions_to_be_labeled)}')
-            self._tenant_energy_label = self._tenant.get_energy_label(self.defender_for_cloud_findings)
+            self._logger.debug(f'Tenant subscriptions labeled are {len(self.tenant.subscriptions_to_be_labeled)}')
+            self._tenant_energy_label = self.tenant.get_energy_label(self.defender_for_cloud_findings)
         return self._tenant_energy_label
 
     @property
     def labeled_subscriptions_energy_label(self):
         """Energy label of the labeled subscriptions."""
         if self._labeled_subscriptions_energy_label is None:
-            self._labeled_subscriptions_energy_label = self._tenant.get_energy_label_of_targeted_subscriptions(
+            self._labeled_subscriptions_energy_label = self.tenant.get_energy_label_of_targeted_subscriptions(
                 self.defender_for_cloud_findings)
         return self._labeled_subscriptions_energy_label
 
@@ -208,6 +292,6 @@ class AzureEnergyLabeler:  # pylint: disable=too-many-arguments
     def tenant_labeled_subscriptions(self):
         """The tenant labeled subscription objects."""
         if self._tenant_labeled_subscriptions is None:
-            self._tenant_labeled_subscriptions = self._tenant.get_labeled_targeted_subscriptions(
+            self._tenant_labeled_subscriptions = self.tenant.get_labeled_targeted_subscriptions(
                 self.defender_for_cloud_findings)
         return self._tenant_labeled_subscriptions
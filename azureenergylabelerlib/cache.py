@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: cache.py
+#
+# Copyright 2022 Sayantan Khanra
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Main code for cache.
+
+.. _Google Python Style Guide:
+   https://google.github.io/styleguide/pyguide.html
+
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from .configuration import (FINDINGS_CACHE_DIRECTORY,
+                            FINDINGS_CACHE_TTL,
+                            FINDINGS_CACHE_DISABLE_VARIABLE)
+from .entities import Finding
+
+__author__ = '''Sayantan Khanra <skhanra@schubergphilis.com>'''
+__docformat__ = '''google'''
+__date__ = '''22-04-2022'''
+__copyright__ = '''Copyright 2022, Sayantan Khanra'''
+__credits__ = ["Sayantan Khanra"]
+__license__ = '''MIT'''
+__maintainer__ = '''Sayantan Khanra'''
+__email__ = '''<skhanra@schubergphilis.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+LOGGER_BASENAME = '''cache'''
+LOGGER = logging.getLogger(LOGGER_BASENAME)
+LOGGER.addHandler(logging.NullHandler())
+
+
+class FindingsDiskCache:
+    """Persists defender for cloud findings on disk so they can be reused across process runs.
+
+    The cache is opt in, it is only used with a ttl above 0 and setting the environment variable
+    ``AZEL_CACHE_DISABLE`` to ``1`` disables it regardless. The findings are raw tenant security data so the cache
+    directory is only accessible by the owner and every file is written to a private temporary file first and then
+    atomically moved in place, so concurrent runs never read a partially written file.
+    """
+
+    def __init__(self, directory=FINDINGS_CACHE_DIRECTORY, ttl=FINDINGS_CACHE_TTL):
+        self.directory = Path(directory)
+        self.ttl = ttl
+        self._logger = logging.getLogger(f'{LOGGER_BASENAME}.{self.__class__.__name__}')
+
+    @property
+    def enabled(self):
+        """Whether the cache is enabled or not."""
+        return self.ttl > 0 and os.environ.get(FINDINGS_CACHE_DISABLE_VARIABLE) != '1'
+
+    @staticmethod
+    def get_key(tenant_id, frameworks, subscription_ids, denied_resource_group_names=None):
+        """Calculates the cache key of a findings retrieval.
+
+        Args:
+            tenant_id: The id of the tenant the findings are retrieved for.
+            frameworks: The frameworks the findings are retrieved for.
+            subscription_ids: The subscription ids the findings are retrieved for.
+            denied_resource_group_names: The resource group names excluded from the findings.
+
+        Returns:
+            key (str): A hash uniquely identifying the retrieval.
+
+        """
+        key = json.dumps([tenant_id,
+                          sorted(frameworks),
+                          sorted(subscription_ids),
+                          sorted(denied_resource_group_names or [])])
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _get_path(self, key):
+        return self.directory.joinpath(f'{key}.json')
+
+    def get(self, key):
+        """Retrieves the cached findings for the provided key.
+
+        Args:
+            key: The key of the cached findings.
+
+        Returns:
+            findings (list(Findings)): The cached findings, None if they are missing, expired or the cache is disabled.
+
+        """
+        if not self.enabled:
+            return None
+        path = self._get_path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.ttl:
+                self._logger.debug(f'Cached findings {path} have expired.')
+                return None
+            with open(path, 'r', encoding='utf-8') as cache_file:
+                findings = [Finding(finding_details) for finding_details in json.load(cache_file)]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            self._logger.exception(f'Could not read cached findings from {path}.')
+            return None
+        self._logger.debug(f'Retrieved {len(findings)} findings from cache {path}.')
+        return findings
+
+    def set(self, key, findings):
+        """Caches the provided findings under the provided key.
+
+        Args:
+            key: The key to cache the findings under.
+            findings: The findings to cache.
+
+        """
+        if not self.enabled:
+            return
+        path = self._get_path(key)
+        temporary_path = None
+        try:
+            self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+            # mkstemp creates the file readable and writable by the owner only.
+            file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, prefix=f'.{key}.', suffix='.tmp')
+            with open(file_descriptor, 'w', encoding='utf-8') as cache_file:
+                json.dump([finding.data for finding in findings], cache_file)
+            os.replace(temporary_path, path)
+        except OSError:
+            self._logger.exception(f'Could not cache findings to {path}.')
+            if temporary_path is not None:
+                Path(temporary_path).unlink(missing_ok=True)
@@ -31,6 +31,10 @@ Import all parts from configuration here
    https://google.github.io/styleguide/pyguide.html
 """
 import logging
+import os
+import re
+from pathlib import Path
+from types import MappingProxyType
 
 from .datamodels import (TenantEnergyLabelingData,
                          LabeledResourceGroupsData,
@@ -52,54 +56,83 @@ LOGGER_BASENAME = '''configuration'''
 LOGGER = logging.getLogger(LOGGER_BASENAME)
 LOGGER.addHandler(logging.NullHandler())
 
-FINDINGS_QUERY_STRING = "    securityresources\
-    | where type == \"microsoft.security/regulatorycompliancestandards/regulatorycompliancecontrols/regulatorycomplianceassessments\"\
-    | extend complianceStandardId = replace( \"-\", \" \", extract(@'/regulatoryComplianceStandards/([^/]*)', 1, id))\
-    | where complianceStandardId ==  \"{framework}\"\
-    | extend failedResources = toint(properties.failedResources),skippedResources=toint(properties.skippedResources)\
-    | where failedResources + skippedResources > 0 or properties.assessmentType == \"MicrosoftManaged\"\
-    | join kind = leftouter(\
-    securityresources\
-    | where type == \"microsoft.security/assessments\") on subscriptionId, name\
-    | where properties.state != \"Passed\"\
-    | extend firstEvaluationDate = tostring(properties1.status.firstEvaluationDate)\
-    | extend statusChangeDate = tostring(properties1.status.statusChangeDate)\
-    | extend complianceState = tostring(properties.state)\
-    | extend resourceSource = tolower(tostring(properties1.resourceDetails.Source))\
-    | extend recommendationId = iff(isnull(id1) or isempty(id1), id, id1)\
-    | extend resourceId = trim(' ', tolower(tostring(case(resourceSource =~ 'azure', properties1.resourceDetails.Id,\
-                                                        resourceSource =~ 'gcp', properties1.resourceDetails.GcpResourceId,\
-                                                        resourceSource =~ 'aws' and isnotempty(tostring(properties1.resourceDetails.ConnectorId)), properties1.resourceDetails.Id,\
-                                                        resourceSource =~ 'aws', properties1.resourceDetails.AwsResourceId,\
-                                                        extract('^(.+)/providers/Microsoft.Security/assessments/.+$',1,recommendationId)))))\
-    | extend regexResourceId = extract_all(@\"/providers/[^/]+(?:/([^/]+)/[^/]+(?:/[^/]+/[^/]+)?)?/([^/]+)/([^/]+)$\", resourceId)[0]\
-    | extend resourceType = iff(resourceSource =~ \"aws\" and isnotempty(tostring(properties1.resourceDetails.ConnectorId)), tostring(properties1.additionalData.ResourceType), iff(regexResourceId[1] != \"\", regexResourceId[1], iff(regexResourceId[0] != \"\", regexResourceId[0], \"subscriptions\")))\
-    | extend resourceName = tostring(regexResourceId[2])\
-    | extend recommendationName = name\
-    | extend recommendationDisplayName = tostring(iff(isnull(properties1.displayName) or isempty(properties1.displayName), properties.description, properties1.displayName))\
-    | extend description = tostring(properties1.metadata.description)\
-    | extend remediationSteps = tostring(properties1.metadata.remediationDescription)\
-    | extend severity = tostring(properties1.metadata.severity)\
-    | extend azurePortalRecommendationLink = tostring(properties1.links.azurePortal)\
-    | extend complianceStandardId = replace( \"-\", \" \", extract(@'/regulatoryComplianceStandards/([^/]*)', 1, id))\
-    | extend complianceControlId = extract(@\"/regulatoryComplianceControls/([^/]*)\", 1, id)\
-    | mvexpand statusPerInitiative = properties1.statusPerInitiative\
-                | extend expectedInitiative = statusPerInitiative.policyInitiativeName =~ \"ASC Default\"\
-                | summarize arg_max(expectedInitiative, *) by complianceControlId, recommendationId\
-                | extend state = iff(expectedInitiative, tolower(statusPerInitiative.assessmentStatus.code), tolower(properties1.status.code))\
-                | extend notApplicableReason = iff(expectedInitiative, tostring(statusPerInitiative.assessmentStatus.cause), tostring(properties1.status.cause))\
-                | project-away expectedInitiative\
-    | project firstEvaluationDate, statusChangeDate, complianceStandardId, complianceControlId, complianceState, subscriptionId, resourceGroup = resourceGroup1 ,resourceType, resourceName, resourceId, recommendationId, recommendationName, recommendationDisplayName, description, remediationSteps, severity, state, notApplicableReason, azurePortalRecommendationLink\
-    | join kind = leftouter (securityresources\
-    | where type == \"microsoft.security/regulatorycompliancestandards/regulatorycompliancecontrols\"\
-    | extend complianceStandardId = replace( \"-\", \" \", extract(@'/regulatoryComplianceStandards/([^/]*)', 1, id))\
-    | where complianceStandardId == \"Microsoft cloud security benchmark\"\
-    | extend  controlName = tostring(properties.description)\
-    | project controlId = name, controlName\
-    | distinct  *) on $right.controlId == $left.complianceControlId\
-    | project-away controlId\
-    | distinct *\
-    | order by complianceControlId asc, recommendationId asc"
+COMPLIANCE_STANDARD_ID_REGEX = r'/regulatoryComplianceStandards/([^/]*)'
+
+COMPLIANCE_CONTROL_ID_REGEX = r'/regulatoryComplianceControls/([^/]*)'
+
+RESOURCE_ID_REGEX = r'/providers/[^/]+(?:/([^/]+)/[^/]+(?:/[^/]+/[^/]+)?)?/([^/]+)/([^/]+)$'
+
+# Compiled once for any client side parsing of resource ids, the query embeds the pattern itself.
+RESOURCE_ID_PATTERN = re.compile(RESOURCE_ID_REGEX)
+
+FINDINGS_QUERY_STRING = rf"""    securityresources
+    | where type == "microsoft.security/regulatorycompliancestandards/regulatorycompliancecontrols/regulatorycomplianceassessments"
+    | extend complianceStandardId = replace( "-", " ", extract(@'{COMPLIANCE_STANDARD_ID_REGEX}', 1, id))
+    | where complianceStandardId in ({{frameworks}})
+    | extend failedResources = toint(properties.failedResources),skippedResources=toint(properties.skippedResources)
+    | where failedResources + skippedResources > 0 or properties.assessmentType == "MicrosoftManaged"
+    | join kind = leftouter(
+    securityresources
+    | where type == "microsoft.security/assessments"
+    | project subscriptionId, name, id, resourceGroup, properties) on subscriptionId, name
+    | where properties.state != "Passed"{{denied_resource_groups}}
+    | extend firstEvaluationDate = tostring(properties1.status.firstEvaluationDate)
+    | extend statusChangeDate = tostring(properties1.status.statusChangeDate)
+    | extend complianceState = tostring(properties.state)
+    | extend resourceSource = tolower(tostring(properties1.resourceDetails.Source))
+    | extend recommendationId = iff(isnull(id1) or isempty(id1), id, id1)
+    | extend resourceId = trim(' ', tolower(tostring(case(resourceSource =~ 'azure', properties1.resourceDetails.Id,
+                                                        resourceSource =~ 'gcp', properties1.resourceDetails.GcpResourceId,
+                                                        resourceSource =~ 'aws' and isnotempty(tostring(properties1.resourceDetails.ConnectorId)), properties1.resourceDetails.Id,
+                                                        resourceSource =~ 'aws', properties1.resourceDetails.AwsResourceId,
+                                                        extract('^(.+)/providers/Microsoft.Security/assessments/.+$',1,recommendationId)))))
+    | extend regexResourceId = extract_all(@"{RESOURCE_ID_REGEX}", resourceId)[0]
+    | extend resourceType = iff(resourceSource =~ "aws" and isnotempty(tostring(properties1.resourceDetails.ConnectorId)), tostring(properties1.additionalData.ResourceType), iff(regexResourceId[1] != "", regexResourceId[1], iff(regexResourceId[0] != "", regexResourceId[0], "subscriptions")))
+    | extend resourceName = tostring(regexResourceId[2])
+    | extend recommendationName = name
+    | extend recommendationDisplayName = tostring(iff(isnull(properties1.displayName) or isempty(properties1.displayName), properties.description, properties1.displayName))
+    | extend description = tostring(properties1.metadata.description)
+    | extend remediationSteps = tostring(properties1.metadata.remediationDescription)
+    | extend severity = tostring(properties1.metadata.severity)
+    | extend azurePortalRecommendationLink = tostring(properties1.links.azurePortal)
+    | extend complianceStandardId = replace( "-", " ", extract(@'{COMPLIANCE_STANDARD_ID_REGEX}', 1, id))
+    | extend complianceControlId = extract(@"{COMPLIANCE_CONTROL_ID_REGEX}", 1, id)
+    | mvexpand statusPerInitiative = properties1.statusPerInitiative
+                | extend expectedInitiative = statusPerInitiative.policyInitiativeName =~ "ASC Default"
+                | summarize arg_max(expectedInitiative, *) by complianceControlId, recommendationId
+                | extend state = iff(expectedInitiative, tolower(statusPerInitiative.assessmentStatus.code), tolower(properties1.status.code))
+                | extend notApplicableReason = iff(expectedInitiative, tostring(statusPerInitiative.assessmentStatus.cause), tostring(properties1.status.cause))
+                | project-away expectedInitiative
+    | project id, firstEvaluationDate, statusChangeDate, complianceStandardId, complianceControlId, complianceState, subscriptionId, resourceGroup = resourceGroup1 ,resourceType, resourceName, resourceId, recommendationId, recommendationName, recommendationDisplayName, description, remediationSteps, severity, state, notApplicableReason, azurePortalRecommendationLink
+    | join kind = leftouter (securityresources
+    | where type == "microsoft.security/regulatorycompliancestandards/regulatorycompliancecontrols"
+    | extend complianceStandardId = replace( "-", " ", extract(@'{COMPLIANCE_STANDARD_ID_REGEX}', 1, id))
+    | where complianceStandardId in ({{frameworks}})
+    | extend  controlName = tostring(properties.description)
+    | project controlId = name, controlName
+    | distinct  *) on $right.controlId == $left.complianceControlId
+    | project-away controlId
+    | distinct *
+    | order by complianceControlId asc, recommendationId asc"""
+
+DENIED_RESOURCE_GROUPS_QUERY_CHUNK_SIZE = 256
+
+RESOURCE_GRAPH_PAGE_SIZE = 1000
+
+RESOURCE_GRAPH_SUBSCRIPTIONS_BATCH_SIZE = 1000
+
+RESOURCE_GRAPH_MAX_CONCURRENT_QUERIES = 4
+
+RESOURCE_GRAPH_THROTTLING_RETRIES = 5
+
+RESOURCE_GRAPH_THROTTLING_DEFAULT_WAIT = 5
+
+RESOURCE_GRAPH_THROTTLING_WAIT_MARGIN = 0.5
+
+BLOB_UPLOAD_MAX_CONCURRENCY = 4
+
+AZURE_CLIENT_RETRY_SETTINGS = MappingProxyType({'retry_status': 5,
+                                                'retry_backoff_factor': 2.0})
 
 TENANT_THRESHOLDS = [{'label': 'A',
                       'percentage': 90},
@@ -164,35 +197,38 @@ RESOURCE_GROUP_THRESHOLDS = [{'label': 'A',
                               'low': 100,
                               'days_open_less_than': 999}]
 
-DEFAULT_DEFENDER_FOR_CLOUD_FRAMEWORKS = {'Microsoft cloud security benchmark',
-                                         'Azure CIS 1.1.0'}
-
-FILE_EXPORT_TYPES = [
-    {'type': 'tenant_energy_label',
-     'filename': 'tenant-energy-label.json',
-     'object_type': TenantEnergyLabelingData,
-     'required_arguments': ['id', 'energy_label', 'labeled_subscriptions', 'defender_for_cloud_findings']},
-    {'type': 'findings',
-     'filename': 'defender-for-cloud-findings.json',
-     'object_type': DefenderForCloudFindingsData,
-     'required_arguments': ['defender_for_cloud_findings']},
-    {'type': 'labeled_subscriptions',
-     'filename': 'labeled-subscriptions.json',
-     'object_type': LabeledSubscriptionsData,
-     'required_arguments': ['labeled_subscriptions']},
-    {'type': 'subscription_energy_label',
-     'filename': 'subscription-energy-label.json',
-     'object_type': LabeledSubscriptionsData,
-     'required_arguments': ['labeled_subscriptions', 'defender_for_cloud_findings']},
-    {'type': 'exempted_policies',
-     'filename': 'exempted-policies.json',
-     'object_type': SubscriptionExemptedPolicies,
-     'required_arguments': ['labeled_subscriptions']},
-    {'type': 'resource_group_energy_label',
-     'filename': 'resource-group-energy-label.json',
-     'object_type': LabeledResourceGroupsData,
-     'required_arguments': ['labeled_subscriptions', 'defender_for_cloud_findings']},
-]
+DEFAULT_DEFENDER_FOR_CLOUD_FRAMEWORKS = frozenset({'Microsoft cloud security benchmark',
+                                                   'Azure CIS 1.1.0'})
+
+FILE_EXPORT_TYPES = (
+    MappingProxyType({'type': 'tenant_energy_label',
+                      'filename': 'tenant-energy-label.json',
+                      'object_type': TenantEnergyLabelingData,
+                      'required_arguments': ('id', 'energy_label', 'labeled_subscriptions', 'defender_for_cloud_findings')}),
+    MappingProxyType({'type': 'findings',
+                      'filename': 'defender-for-cloud-findings.json',
+                      'object_type': DefenderForCloudFindingsData,
+                      'required_arguments': ('defender_for_cloud_findings',)}),
+    MappingProxyType({'type': 'labeled_subscriptions',
+                      'filename': 'labeled-subscriptions.json',
+                      'object_type': LabeledSubscriptionsData,
+                      'required_arguments': ('labeled_subscriptions',)}),
+    MappingProxyType({'type': 'subscription_energy_label',
+                      'filename': 'subscription-energy-label.json',
+                      'object_type': LabeledSubscriptionsData,
+                      'required_arguments': ('labeled_subscriptions', 'defender_for_cloud_findings')}),
+    MappingProxyType({'type': 'exempted_policies',
+                      'filename': 'exempted-policies.json',
+                      'object_type': SubscriptionExemptedPolicies,
+                      'required_arguments': ('labeled_subscriptions',)}),
+    MappingProxyType({'type': 'resource_group_energy_label',
+                      'filename': 'resource-group-energy-label.json',
+                      'object_type': LabeledResourceGroupsData,
+                      'required_arguments': ('labeled_subscriptions', 'defender_for_cloud_findings')}),
+)
+
+FILE_EXPORT_TYPES_BY_TYPE = MappingProxyType({file_export_type['type']: file_export_type
+                                             for file_export_type in FILE_EXPORT_TYPES})
 
 DATA_EXPORT_TYPES = ['findings']
 
@@ -210,15 +246,17 @@ ALL_TENANT_EXPORT_TYPES = TENANT_METRIC_EXPORT_TYPES + ALL_SUBSCRIPTION_EXPORT_D
 
 SUBSCRIPTION_ID_LENGTH = 36
 
-ENERGY_LABEL_CALCULATION_CONFIG = [
-    {
-        'object_type': 'resource_group',
-        'energy_label_object': ResourceGroupEnergyLabel
-    },
-    {
-        'object_type': 'subscription',
-        'energy_label_object': SubscriptionEnergyLabel
-    }
-]
-
-FINDING_FILTERING_STATES = ('notapplicable', 'healthy')
+FINDINGS_CACHE_DIRECTORY = Path(os.environ.get('XDG_CACHE_HOME') or Path('~/.cache').expanduser(), 'azureenergylabeler')
+
+FINDINGS_CACHE_TTL = 0
+
+FINDINGS_IN_MEMORY_CACHE_TTL = 120
+
+FINDINGS_CACHE_DISABLE_VARIABLE = 'AZEL_CACHE_DISABLE'
+
+ENERGY_LABEL_CALCULATION_CONFIG = MappingProxyType({
+    'resource_group': ResourceGroupEnergyLabel,
+    'subscription': SubscriptionEnergyLabel
+})
+
+FINDING_FILTERING_STATES = frozenset({'notapplicable', 'healthy'})
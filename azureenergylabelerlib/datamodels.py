@@ -31,8 +31,19 @@ Main code for datamodels.
 
 """
 
+import gzip
 import logging
 import json
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from operator import attrgetter
+from .utils import normalize_name, group_findings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 __author__ = '''Sayantan Khanra <skhanra@schubergphilis.com>'''
 __docformat__ = '''google'''
@@ -49,143 +60,419 @@ LOGGER_BASENAME = '''datamodels'''
 LOGGER = logging.getLogger(LOGGER_BASENAME)
 LOGGER.addHandler(logging.NullHandler())
 
+GZIP_COMPRESSION_LEVEL = 3
+
+SUBSCRIPTIONS_DATA_CONCURRENCY_THRESHOLD = 8
+
+SUBSCRIPTIONS_DATA_MAX_WORKERS = 16
+
+FINDING_EXPORT_COLUMNS = (('Compliance Standard ID', 'compliance_standard_id'),
+                          ('Compliance Control ID', 'compliance_control_id'),
+                          ('Compliance State', 'compliance_state'),
+                          ('Subscription ID', 'subscription_id'),
+                          ('Resource Group', 'resource_group'),
+                          ('Resource Type', 'resource_type'),
+                          ('Resource Name', 'resource_name'),
+                          ('Resource ID', 'resource_id'),
+                          ('Severity', 'severity'),
+                          ('State', 'state'),
+                          ('Recommendation ID', 'recommendation_id'),
+                          ('Recommendation Name', 'recommendation_name'),
+                          ('Recommendation Display Name', 'recommendation_display_name'),
+                          ('Description', 'description'),
+                          ('Remediation Steps', 'remediation_steps'),
+                          ('Azure Portal Recommendation Link', 'azure_portal_recommendation_link'),
+                          ('Control Name', 'control_name'),
+                          ('Days Open', 'days_open'))
+
+FINDING_EXPORT_COLUMN_NAMES = tuple(column for column, _ in FINDING_EXPORT_COLUMNS)
+
+get_finding_export_values = attrgetter(*[attribute for _, attribute in FINDING_EXPORT_COLUMNS])
+
+get_energy_label_values = attrgetter('number_of_high_findings',
+                                     'number_of_medium_findings',
+                                     'number_of_low_findings',
+                                     'max_days_open',
+                                     'label')
+
+
+def _use_orjson(indent):
+    return orjson is not None and indent in (None, 2)
+
+
+def _get_orjson_option(indent):
+    option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS  # pylint: disable=no-member
+    if indent:
+        option |= orjson.OPT_INDENT_2  # pylint: disable=no-member
+    return option
+
+
+def format_datetime(value):
+    """Formats a datetime the way the json serializers fall back to, leaving missing values as they are.
+
+    Formatting datetimes while building the data saves the serializers a fallback call per value.
+
+    Args:
+        value: The datetime to format.
+
+    Returns:
+        value (str): The formatted datetime, None if no datetime was provided.
+
+    """
+    return None if value is None else str(value)
+
+
+def _get_json_arguments(indent):
+    if indent:
+        return {'indent': indent, 'default': str, 'ensure_ascii': False}
+    return {'separators': (',', ':'), 'default': str, 'ensure_ascii': False}
+
+
+def to_json(data, indent=None):
+    """Serializes data to json, using orjson when it is installed.
+
+    Datetimes and dataclasses are passed through to the str fallback with orjson as well and json writes non ascii
+    characters unescaped like orjson does, so the output does not depend on the serializer used. orjson only indents
+    by two spaces, any other indentation falls back to json.
+
+    Args:
+        data: The data to serialize.
+        indent: The number of spaces to indent the json with, compact json without any whitespace if not provided.
+
+    Returns:
+        json (str): The data serialized as json.
+
+    """
+    if _use_orjson(indent):
+        return orjson.dumps(data, default=str, option=_get_orjson_option(indent)).decode('utf-8')  # pylint: disable=no-member
+    return json.dumps(data, **_get_json_arguments(indent))
+
+
+def to_json_bytes(data, indent=None):
+    """Serializes data to utf-8 encoded json, using orjson when it is installed.
+
+    orjson serializes straight to bytes, so this skips the round trip through str when the json is not needed as text.
+
+    Args:
+        data: The data to serialize.
+        indent: The number of spaces to indent the json with, compact json without any whitespace if not provided.
+
+    Returns:
+        json (bytes): The data serialized as utf-8 encoded json.
+
+    """
+    if _use_orjson(indent):
+        return orjson.dumps(data, default=str, option=_get_orjson_option(indent))  # pylint: disable=no-member
+    return json.dumps(data, **_get_json_arguments(indent)).encode('utf-8')
+
+
+def write_json(data, path, indent=None, compress=False):
+    """Writes data as json to a file without building the json as an intermediate string.
+
+    orjson serializes straight to the bytes written, json streams its output to the file in chunks.
+
+    Args:
+        data: The data to serialize.
+        path: The path of the file to write.
+        indent: The number of spaces to indent the json with, compact json without any whitespace if not provided.
+        compress: Whether to gzip the file.
+
+    """
+    open_file = partial(gzip.open, compresslevel=GZIP_COMPRESSION_LEVEL) if compress else open
+    if _use_orjson(indent):
+        with open_file(path, 'wb') as json_file:
+            json_file.write(orjson.dumps(data, default=str, option=_get_orjson_option(indent)))  # pylint: disable=no-member
+        return
+    with open_file(path, 'wt', encoding='utf-8') as json_file:
+        json.dump(data, json_file, **_get_json_arguments(indent))
+
+
+def write_json_rows(rows, path, indent=None, compress=False):
+    """Writes rows as a json array to a file, serializing a single row at a time.
+
+    The rows can be a generator so they never need to be held in memory all together, the json written is the same as
+    the one written by write_json for a list of the rows.
+
+    Args:
+        rows: The rows to serialize.
+        path: The path of the file to write.
+        indent: The number of spaces to indent the json with, compact json without any whitespace if not provided.
+        compress: Whether to gzip the file.
+
+    """
+    open_file = partial(gzip.open, compresslevel=GZIP_COMPRESSION_LEVEL) if compress else open
+    padding = f'\n{" " * indent}' if indent else ''
+    opening, separator, closing = ('[' + padding, ',' + padding, '\n]') if indent else ('[', ',', ']')
+    with open_file(path, 'wt', encoding='utf-8') as json_file:
+        empty = True
+        for row in rows:
+            json_file.write(opening if empty else separator)
+            json_file.write(to_json(row, indent).replace('\n', padding) if indent else to_json(row))
+            empty = False
+        json_file.write('[]' if empty else closing)
+
+
+class ExportData(ABC):
+    """Base of the data models exported to json."""
+
+    __slots__ = ('filename', '_indent')
+
+    def __init__(self, filename, indent=None):
+        self.filename = filename
+        self._indent = indent
+
+    @property
+    @abstractmethod
+    def data(self):
+        """Data to export."""
+
+    @property
+    def json(self):
+        """Data to json."""
+        return to_json(self.data, self._indent)
+
+    @property
+    def json_bytes(self):
+        """Data to utf-8 encoded json."""
+        return to_json_bytes(self.data, self._indent)
+
+    def write(self, path=None, compress=False):
+        """Writes the data as json to a file.
+
+        Args:
+            path: The path of the file to write, defaults to the filename of the data.
+            compress: Whether to gzip the file, which gets a .gz suffix added.
+
+        Returns:
+            path (str): The path of the file written.
+
+        """
+        path = str(path or self.filename)
+        if compress:
+            path = f'{path}.gz'
+        self._write_data(path, compress)
+        return path
+
+    def _write_data(self, path, compress):
+        write_json(self.data, path, self._indent, compress)
+
+
+def get_subscription_data(subscription, defender_for_cloud_findings):
+    """Builds the data of a labeled subscription to export.
+
+    Args:
+        subscription: The subscription to export.
+        defender_for_cloud_findings: The findings to label the subscription with.
+
+    Returns:
+        data (dict): The data of the subscription to export.
+
+    """
+    high, medium, low, max_days_open, label = get_energy_label_values(
+        subscription.get_energy_label(defender_for_cloud_findings))
+    return {'Subscription ID': subscription.subscription_id,
+            'Subscription Display Name': subscription.display_name,
+            'Number of high findings': high,
+            'Number of medium findings': medium,
+            'Number of low findings': low,
+            'Number of exempted findings': len(subscription.exempted_policies),
+            'Number of maximum days open': max_days_open,
+            'Energy Label': label}
+
+
+def get_subscriptions_data(subscriptions, defender_for_cloud_findings):
+    """Builds the data of multiple labeled subscriptions to export.
+
+    The findings are grouped by subscription once, so every subscription is labeled with its own findings instead of
+    scanning all the findings of the tenant. Building the data of a subscription retrieves its exempted policies, so for
+    more than a handful of subscriptions the data is built concurrently to overlap those requests.
+
+    Args:
+        subscriptions: The subscriptions to export.
+        defender_for_cloud_findings: The findings to label the subscriptions with.
+
+    Returns:
+        data (list(dict)): The data of the subscriptions to export, in the order of the subscriptions.
 
-class TenantEnergyLabelingData:
+    """
+    subscriptions = list(subscriptions)
+    findings_by_subscription_id = group_findings(defender_for_cloud_findings, 'subscription_id')
+    findings = [findings_by_subscription_id.get(normalize_name(subscription.subscription_id), ()) for subscription in subscriptions]
+    if len(subscriptions) < SUBSCRIPTIONS_DATA_CONCURRENCY_THRESHOLD:
+        return list(map(get_subscription_data, subscriptions, findings))
+    with ThreadPoolExecutor(max_workers=min(SUBSCRIPTIONS_DATA_MAX_WORKERS, len(subscriptions))) as executor:
+        return list(executor.map(get_subscription_data, subscriptions, findings))
+
+
+def get_subscriptions_resource_groups(subscriptions):
+    """Retrieves the resource groups of multiple subscriptions.
+
+    Every subscription lists its resource groups with a request of its own, so for more than a handful of
+    subscriptions the requests are made concurrently.
+
+    Args:
+        subscriptions: The subscriptions to retrieve the resource groups of.
+
+    Returns:
+        resource_groups (list(list)): The resource groups of each subscription, in the order of the subscriptions.
+
+    """
+    subscriptions = list(subscriptions)
+    get_resource_groups = attrgetter('resource_groups')
+    if len(subscriptions) < SUBSCRIPTIONS_DATA_CONCURRENCY_THRESHOLD:
+        return list(map(get_resource_groups, subscriptions))
+    with ThreadPoolExecutor(max_workers=min(SUBSCRIPTIONS_DATA_MAX_WORKERS, len(subscriptions))) as executor:
+        return list(executor.map(get_resource_groups, subscriptions))
+
+
+def get_resource_group_data(subscription_id, resource_group, defender_for_cloud_findings):
+    """Builds the data of a labeled resource group to export.
+
+    Args:
+        subscription_id: The id of the subscription of the resource group.
+        resource_group: The resource group to export.
+        defender_for_cloud_findings: The findings to label the resource group with.
+
+    Returns:
+        data (dict): The data of the resource group to export.
+
+    """
+    high, medium, low, max_days_open, label = get_energy_label_values(
+        resource_group.get_energy_label(defender_for_cloud_findings))
+    return {'Subscription ID': subscription_id,
+            'ResourceGroup Name': resource_group.name,
+            'Number of high findings': high,
+            'Number of medium findings': medium,
+            'Number of low findings': low,
+            'Number of maximum days open': max_days_open,
+            'Energy Label': label}
+
+
+class TenantEnergyLabelingData(ExportData):
     """Models the data for energy labeling to export."""
 
+    __slots__ = ('_id', '_energy_label', '_labeled_subscriptions', '_defender_for_cloud_findings')
+
     def __init__(self,  # pylint: disable= too-many-arguments
                  filename,
                  id,  # pylint: disable= redefined-builtin
                  energy_label,
                  labeled_subscriptions,
-                 defender_for_cloud_findings):
-        self.filename = filename
+                 defender_for_cloud_findings,
+                 indent=None):
+        super().__init__(filename, indent)
         self._id = id
         self._energy_label = energy_label
         self._labeled_subscriptions = labeled_subscriptions
         self._defender_for_cloud_findings = defender_for_cloud_findings
 
     @property
-    def json(self):
-        """Data to json."""
-        subscription_metrics = []
-        for subscription in self._labeled_subscriptions:
-            energy_label = subscription.get_energy_label(self._defender_for_cloud_findings)
-            subscription_metrics.append({
-                'Subscription ID': subscription.subscription_id,
-                'Subscription Display Name': subscription.display_name,
-                'Number of high findings': energy_label.number_of_high_findings,
-                'Number of medium findings': energy_label.number_of_medium_findings,
-                'Number of low findings': energy_label.number_of_low_findings,
-                'Number of exempted findings': len(subscription.exempted_policies),
-                'Number of maximum days open': energy_label.max_days_open,
-                'Energy Label': energy_label.label
-            })
-        return json.dumps(
-            [{
-                'Tenant ID': self._id,
-                'Tenant Energy Label': self._energy_label,
-                'Labeled subscriptions': subscription_metrics
-            }], indent=2, default=str)
-
-
-class DefenderForCloudFindingsData:
-    """Models the data for energy labeling to export."""
+    def data(self):
+        """Data of the tenant to export."""
+        subscription_metrics = get_subscriptions_data(self._labeled_subscriptions, self._defender_for_cloud_findings)
+        return [{
+            'Tenant ID': self._id,
+            'Tenant Energy Label': self._energy_label,
+            'Labeled subscriptions': subscription_metrics
+        }]
 
-    def __init__(self, filename, defender_for_cloud_findings):
-        self.filename = filename
-        self._defender_for_cloud_findings = defender_for_cloud_findings
+
+class DefenderForCloudFindingsData(ExportData):
+    """Models the data for energy labeling to export.
+
+    The findings are exported either as a list of objects or, when columnar, as a single object holding the column
+    names once and a list of rows with the values of each finding.
+    """
+
+    __slots__ = ('_active_findings', '_columnar', '_json')
+
+    def __init__(self, filename, defender_for_cloud_findings, indent=None, columnar=False):
+        super().__init__(filename, indent)
+        self._active_findings = tuple(finding for finding in defender_for_cloud_findings if not finding.is_skipped)
+        self._columnar = columnar
+        self._json = None
+
+    @property
+    def data(self):
+        """Data of the findings to export."""
+        if self._columnar:
+            return {'columns': list(FINDING_EXPORT_COLUMN_NAMES),
+                    'rows': [list(get_finding_export_values(finding)) for finding in self._active_findings]}
+        return [dict(zip(FINDING_EXPORT_COLUMN_NAMES, get_finding_export_values(finding)))
+                for finding in self._active_findings]
 
     @property
     def json(self):
         """Data to json."""
-        return json.dumps([{'Compliance Standard ID': finding.compliance_standard_id,
-                            'Compliance Control ID': finding.compliance_control_id,
-                            'Compliance State': finding.compliance_state,
-                            'Subscription ID': finding.subscription_id,
-                            'Resource Group': finding.resource_group,
-                            'Resource Type': finding.resource_type,
-                            'Resource Name': finding.resource_name,
-                            'Resource ID': finding.resource_id,
-                            'Severity': finding.severity,
-                            'State': finding.state,
-                            'Recommendation ID': finding.recommendation_id,
-                            'Recommendation Name': finding.recommendation_name,
-                            'Recommendation Display Name': finding.recommendation_display_name,
-                            'Description': finding.description,
-                            'Remediation Steps': finding.remediation_steps,
-                            'Azure Portal Recommendation Link': finding.azure_portal_recommendation_link,
-                            'Control Name': finding.control_name,
-                            'Days Open': finding.days_open
-                            }
-                           for finding in self._defender_for_cloud_findings if not finding.is_skipped],
-                          indent=2, default=str)
-
-
-class SubscriptionExemptedPolicies:
+        if self._json is None:
+            self._json = to_json(self.data, self._indent)
+        return self._json
+
+    @property
+    def json_bytes(self):
+        """Data to utf-8 encoded json."""
+        if self._json is not None:
+            return self._json.encode('utf-8')
+        return to_json_bytes(self.data, self._indent)
+
+
+class SubscriptionExemptedPolicies(ExportData):
     """Models the data for exempted policies to export."""
 
-    def __init__(self, filename, labeled_subscriptions):
-        self.filename = filename
+    __slots__ = ('_labeled_subscriptions',)
+
+    def __init__(self, filename, labeled_subscriptions, indent=None):
+        super().__init__(filename, indent)
         self._labeled_subscriptions = labeled_subscriptions
 
     @property
     def data(self):
         """Data of an subscription exempted policies to export."""
-        exempted_policies = []
+        return list(self._iter_data())
+
+    def _iter_data(self):
         for subscription in self._labeled_subscriptions:
+            subscription_id = subscription.subscription_id
             for exempted_policy in subscription.exempted_policies:
-                exempted_policies.append({'Subscription ID': subscription.subscription_id,
-                                          'Created At': exempted_policy.system_data.created_at,
-                                          'Created By': exempted_policy.system_data.created_by,
-                                          'Description': exempted_policy.description,
-                                          'Display Name': exempted_policy.display_name,
-                                          'Exemption Category': exempted_policy.exemption_category,
-                                          'Last Modified By': exempted_policy.system_data.last_modified_by,
-                                          'Last Modified At': exempted_policy.system_data.last_modified_at,
-                                          'Name': exempted_policy.name,
-                                          'Expires On': exempted_policy.expires_on
-                                          })
-        return exempted_policies
-
-    @property
-    def json(self):
-        """Data to json."""
-        return json.dumps(self.data, indent=2, default=str)
-
-
-class LabeledSubscriptionData:
+                system_data = exempted_policy.system_data
+                yield {'Subscription ID': subscription_id,
+                       'Created At': format_datetime(system_data.created_at),
+                       'Created By': system_data.created_by,
+                       'Description': exempted_policy.description,
+                       'Display Name': exempted_policy.display_name,
+                       'Exemption Category': exempted_policy.exemption_category,
+                       'Last Modified By': system_data.last_modified_by,
+                       'Last Modified At': format_datetime(system_data.last_modified_at),
+                       'Name': exempted_policy.name,
+                       'Expires On': format_datetime(exempted_policy.expires_on)}
+
+    def _write_data(self, path, compress):
+        write_json_rows(self._iter_data(), path, self._indent, compress)
+
+
+class LabeledSubscriptionData(ExportData):
     """Models the data for energy labeling to export."""
 
-    def __init__(self, filename, labeled_subscription, defender_for_cloud_findings):
-        self.filename = filename
+    __slots__ = ('_labeled_subscription', '_defender_for_cloud_findings')
+
+    def __init__(self, filename, labeled_subscription, defender_for_cloud_findings, indent=None):
+        super().__init__(filename, indent)
         self._labeled_subscription = labeled_subscription
         self._defender_for_cloud_findings = defender_for_cloud_findings
 
     @property
     def data(self):
         """Data of an subscription to export."""
-        energy_label = self._labeled_subscription.get_energy_label(self._defender_for_cloud_findings)
-        return {'Subscription ID': self._labeled_subscription.subscription_id,
-                'Subscription Display Name': self._labeled_subscription.display_name,
-                'Number of high findings': energy_label.number_of_high_findings,
-                'Number of medium findings': energy_label.number_of_medium_findings,
-                'Number of low findings': energy_label.number_of_low_findings,
-                'Number of exempted findings': len(self._labeled_subscription.exempted_policies),
-                'Number of maximum days open': energy_label.max_days_open,
-                'Energy Label': energy_label.label}
-
-    @property
-    def json(self):
-        """Data to json."""
-        return json.dumps(self.data, indent=2, default=str)
+        return get_subscription_data(self._labeled_subscription, self._defender_for_cloud_findings)
 
 
-class LabeledResourceGroupData:
+class LabeledResourceGroupData(ExportData):
     """Models the data for energy labeling to export."""
 
-    def __init__(self, filename, labeled_resource_group_data, defender_for_cloud_findings):
-        self.filename = filename
+    __slots__ = ('_subscription_id', '_labeled_resource_group', '_defender_for_cloud_findings')
+
+    def __init__(self, filename, labeled_resource_group_data, defender_for_cloud_findings, indent=None):
+        super().__init__(filename, indent)
         self._subscription_id = labeled_resource_group_data.get('subscription_id')
         self._labeled_resource_group = labeled_resource_group_data.get('labeled_resource_group')
         self._defender_for_cloud_findings = defender_for_cloud_findings
@@ -193,56 +480,48 @@ class LabeledResourceGroupData:
     @property
     def data(self):
         """Data of an subscription to export."""
-        energy_label = self._labeled_resource_group.get_energy_label(self._defender_for_cloud_findings)
-        return {'Subscription ID': self._subscription_id,
-                'ResourceGroup Name': self._labeled_resource_group.name,
-                'Number of high findings':
-                    energy_label.number_of_high_findings,
-                'Number of medium findings': energy_label.number_of_medium_findings,
-                'Number of low findings': energy_label.number_of_low_findings,
-                'Number of maximum days open': energy_label.max_days_open,
-                'Energy Label': energy_label.label}
-
-    @property
-    def json(self):
-        """Data to json."""
-        return json.dumps(self.data, indent=2, default=str)
+        return get_resource_group_data(self._subscription_id,
+                                       self._labeled_resource_group,
+                                       self._defender_for_cloud_findings)
 
 
-class LabeledResourceGroupsData:
+class LabeledResourceGroupsData(ExportData):
     """Models the data for energy labeling to export."""
 
-    def __init__(self, filename, labeled_subscriptions, defender_for_cloud_findings):
-        self.filename = filename
+    __slots__ = ('_labeled_subscriptions', '_defender_for_cloud_findings')
+
+    def __init__(self, filename, labeled_subscriptions, defender_for_cloud_findings, indent=None):
+        super().__init__(filename, indent)
         self._labeled_subscriptions = labeled_subscriptions
         self._defender_for_cloud_findings = defender_for_cloud_findings
 
     @property
-    def json(self):
-        """Data to json."""
-        labeled_resource_groups = []
-        for subscription in self._labeled_subscriptions:
-            for resource_group in subscription.resource_groups:
-                labeled_resource_groups.append({
-                    'subscription_id': subscription.subscription_id,
-                    'labeled_resource_group': resource_group
-                })
-        return json.dumps([LabeledResourceGroupData(self.filename,
-                                                    resource_group,
-                                                    self._defender_for_cloud_findings).data
-                           for resource_group in labeled_resource_groups], indent=2, default=str)
-
-
-class LabeledSubscriptionsData:
+    def data(self):
+        """Data of the resource groups to export.
+
+        The findings are grouped by their resource group once, so every resource group is labeled with its own
+        findings instead of scanning all the findings of the tenant.
+        """
+        findings_by_resource_group = group_findings(self._defender_for_cloud_findings, 'resource_group')
+        subscriptions = list(self._labeled_subscriptions)
+        return [get_resource_group_data(subscription.subscription_id,
+                                        resource_group,
+                                        findings_by_resource_group.get(normalize_name(resource_group.name), ()))
+                for subscription, resource_groups in zip(subscriptions, get_subscriptions_resource_groups(subscriptions))
+                for resource_group in resource_groups]
+
+
+class LabeledSubscriptionsData(ExportData):
     """Models the data for energy labeling to export."""
 
-    def __init__(self, filename, labeled_subscriptions, defender_for_cloud_findings):
-        self.filename = filename
+    __slots__ = ('_labeled_subscriptions', 'defender_for_cloud_findings')
+
+    def __init__(self, filename, labeled_subscriptions, defender_for_cloud_findings, indent=None):
+        super().__init__(filename, indent)
         self._labeled_subscriptions = labeled_subscriptions
         self.defender_for_cloud_findings = defender_for_cloud_findings
 
     @property
-    def json(self):
-        """Data to json."""
-        return json.dumps([LabeledSubscriptionData(self.filename, subscription, self.defender_for_cloud_findings).data
-                           for subscription in self._labeled_subscriptions], indent=2, default=str)
+    def data(self):
+        """Data of the subscriptions to export."""
+        return get_subscriptions_data(self._labeled_subscriptions, self.defender_for_cloud_findings)
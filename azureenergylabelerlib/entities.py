@@ -32,29 +32,35 @@ Main code for entities.
 """
 
 import logging
-from copy import copy
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from collections import Counter
-from urllib.parse import urlparse
-from pathlib import Path
-from datetime import datetime
-from cachetools import cached, TTLCache
-from azure.mgmt.resource import SubscriptionClient, ResourceManagementClient
-from azure.storage.blob import BlobServiceClient
-from azure.mgmt.resource.policy import PolicyClient
-import azure.mgmt.resourcegraph as arg
+from functools import lru_cache, partial
+from itertools import chain
+from datetime import datetime, timezone
 from .configuration import (TENANT_THRESHOLDS,
                             SUBSCRIPTION_THRESHOLDS,
                             RESOURCE_GROUP_THRESHOLDS,
                             FINDINGS_QUERY_STRING,
-                            FILE_EXPORT_TYPES,
+                            DENIED_RESOURCE_GROUPS_QUERY_CHUNK_SIZE,
+                            RESOURCE_GRAPH_PAGE_SIZE,
+                            RESOURCE_GRAPH_SUBSCRIPTIONS_BATCH_SIZE,
+                            RESOURCE_GRAPH_MAX_CONCURRENT_QUERIES,
+                            RESOURCE_GRAPH_THROTTLING_RETRIES,
+                            RESOURCE_GRAPH_THROTTLING_DEFAULT_WAIT,
+                            RESOURCE_GRAPH_THROTTLING_WAIT_MARGIN,
+                            AZURE_CLIENT_RETRY_SETTINGS,
                             ENERGY_LABEL_CALCULATION_CONFIG,
                             FINDING_FILTERING_STATES)
-from .validations import validate_allowed_denied_subscription_ids, DestinationPath
+from .validations import validate_allowed_denied_subscription_ids, validate_resource_group_names
 from .azureenergylabelerlibexceptions import (SubscriptionNotPartOfTenant,
-                                              InvalidFrameworks,
-                                              InvalidPath)
+                                              InvalidFrameworks)
 from .labels import (TenantEnergyLabel,
                      AggregateSubscriptionEnergyLabel)
+from .utils import minify_query, normalize_name, build_thresholds, group_findings
+# Exported from here as well for compatibility, the exporters used to live in this module.
+from .exporters import DataExporter, DataFileFactory  # pylint: disable=unused-import
 
 __author__ = '''Sayantan Khanra <skhanra@schubergphilis.com>'''
 __docformat__ = '''google'''
@@ -70,6 +76,34 @@ LOGGER_BASENAME = '''entities'''
 LOGGER = logging.getLogger(LOGGER_BASENAME)
 LOGGER.addHandler(logging.NullHandler())
 
+FINDINGS_QUERY_PARTS = tuple(minify_query(FINDINGS_QUERY_STRING).split('{frameworks}'))
+
+SUBSCRIPTION_THRESHOLD_TABLE = build_thresholds(SUBSCRIPTION_THRESHOLDS)
+RESOURCE_GROUP_THRESHOLD_TABLE = build_thresholds(RESOURCE_GROUP_THRESHOLDS)
+
+# Marks a status change date not parsed yet, None being the result of a date that cannot be parsed.
+NOT_PARSED = object()
+
+
+@lru_cache(maxsize=8)
+def build_findings_query(frameworks, denied_resource_groups_clause=''):
+    """Builds the findings query for one or more frameworks.
+
+    The query template is split around its frameworks placeholders once at import, so building a query is a plain
+    join instead of parsing the whole template with `str.format` on every call.
+
+    Args:
+        frameworks: A tuple of the frameworks to build the findings query for.
+        denied_resource_groups_clause: The clause excluding the findings of the denied resource groups, inserted right
+            after the assessments are joined so the findings are dropped before they are expanded and sorted.
+
+    Returns:
+        query (str): The findings query for the frameworks.
+
+    """
+    query = ', '.join(f'"{framework}"' for framework in frameworks).join(FINDINGS_QUERY_PARTS)
+    return query.replace('{denied_resource_groups}', denied_resource_groups_clause, 1)
+
 
 class DefenderForCloud:
     """Models the Defender for Cloud and retrieves findings."""
@@ -79,10 +113,14 @@ class DefenderForCloud:
 
     def __init__(self,
                  credential,
-                 subscription_list
+                 subscription_list,
+                 denied_resource_group_names=None,
+                 transport=None
                  ):
         self._credential = credential
         self.subscription_list = subscription_list
+        self.denied_resource_group_names = validate_resource_group_names(denied_resource_group_names)
+        self._transport = transport
         self._logger = logging.getLogger(f'{LOGGER_BASENAME}.{self.__class__.__name__}')
 
     @staticmethod
@@ -96,15 +134,145 @@ class DefenderForCloud:
             True if frameworks are valid False otherwise.
 
         """
-        if not isinstance(frameworks, (list, tuple, set)):
+        if not isinstance(frameworks, (list, tuple, set, frozenset)):
             frameworks = [frameworks]
         if set(frameworks).issubset(DefenderForCloud.frameworks):
             return frameworks
         raise InvalidFrameworks(frameworks)
 
+    @staticmethod
+    def _get_denied_resource_groups_clause(denied_resource_group_names):
+        """Builds the query clause excluding the findings of the denied resource groups.
+
+        The names are split over multiple `!in~` operators to stay within the operand limits of the query language.
+        They are embedded in the query as string literals, so only valid resource group names are accepted.
+
+        Args:
+            denied_resource_group_names: The names of the resource groups to exclude.
+
+        Returns:
+            clause (str): The query clause, empty if there are no resource groups to exclude.
+
+        Raises:
+            InvalidResourceGroupListProvided: If any of the names is not a valid resource group name.
+
+        """
+        names = sorted({normalize_name(name) for name in validate_resource_group_names(denied_resource_group_names)})
+        if not names:
+            return ''
+        chunks = [names[index:index + DENIED_RESOURCE_GROUPS_QUERY_CHUNK_SIZE]
+                  for index in range(0, len(names), DENIED_RESOURCE_GROUPS_QUERY_CHUNK_SIZE)]
+        conditions = ['resourceGroup1 !in~ (' + ', '.join(f"'{name}'" for name in chunk) + ')' for chunk in chunks]
+        return f" | where {' and '.join(conditions)}"
+
+    @staticmethod
+    def _get_quota_resets_after(headers):
+        """Calculates the seconds to wait for the resource graph quota to reset from the throttling headers.
+
+        Args:
+            headers: The headers of the throttled response.
+
+        Returns:
+            seconds (int): The seconds until the quota resets, a default wait if the header is missing or invalid.
+
+        """
+        try:
+            hours, minutes, seconds = headers.get('x-ms-user-quota-resets-after', '').split(':')
+            return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+        except ValueError:
+            return RESOURCE_GRAPH_THROTTLING_DEFAULT_WAIT
+
+    def _query_resources(self, arg_client, arg_query):
+        """Runs a resource graph query, waiting for the quota to reset when the query is throttled.
+
+        The client retries do not cover throttled queries, resource graph queries are POST requests and the service
+        signals the throttling with its own quota headers instead of a Retry-After header.
+
+        Args:
+            arg_client: The resource graph client to query with.
+            arg_query: The query request to run.
+
+        Returns:
+            response (QueryResponse): The response of the query.
+
+        Raises:
+            HttpResponseError: If the query fails or is still throttled after all the retries.
+
+        """
+        from azure.core.exceptions import HttpResponseError  # pylint: disable=import-outside-toplevel
+        for attempt in range(1, RESOURCE_GRAPH_THROTTLING_RETRIES):
+            try:
+                return arg_client.resources(arg_query)
+            except HttpResponseError as error:
+                if error.status_code != 429:
+                    raise
+                headers = error.response.headers if error.response is not None else {}
+                wait = self._get_quota_resets_after(headers)
+                self._logger.warning(f'Resource graph query throttled with a remaining quota of '
+                                     f'{headers.get("x-ms-user-quota-remaining")}, retrying in {wait} seconds '
+                                     f'(attempt {attempt} of {RESOURCE_GRAPH_THROTTLING_RETRIES}).')
+                time.sleep(wait + RESOURCE_GRAPH_THROTTLING_WAIT_MARGIN)
+        return arg_client.resources(arg_query)
+
+    def _get_finding_details_for_subscriptions(self, arg_client, query, subscriptions):
+        """Retrieves all the pages of finding details of a query for a batch of subscriptions.
+
+        Args:
+            arg_client: The resource graph client to query with.
+            query: The findings query to run.
+            subscriptions: The ids of the subscriptions to query.
+
+        Returns:
+            finding_details (list(dict)): A list of the raw finding details of the subscriptions.
+
+        """
+        import azure.mgmt.resourcegraph as arg  # pylint: disable=import-outside-toplevel
+        finding_details = []
+        query_options = {'result_format': 'objectArray', 'top': RESOURCE_GRAPH_PAGE_SIZE}
+        while True:
+            arg_query_options = arg.models.QueryRequestOptions(**query_options)
+            arg_query = arg.models.QueryRequest(subscriptions=subscriptions,
+                                                query=query,
+                                                options=arg_query_options)
+            response = self._query_resources(arg_client, arg_query)
+            finding_details.extend(response.data)
+            if not response.skip_token:
+                break
+            query_options.update({'skip_token': response.skip_token})
+        return finding_details
+
+    @staticmethod
+    def _get_unique_findings(finding_details_batches):
+        """Wraps the finding details in findings, skipping the details of recommendations already seen.
+
+        The details are deduplicated on their recommendation id before wrapping them, so no finding is created for a
+        duplicate just to be discarded by a set.
+
+        Args:
+            finding_details_batches: The lists of finding details to wrap.
+
+        Returns:
+            findings (list(Findings)): A list of findings with unique recommendation ids.
+
+        """
+        seen_recommendation_ids = set()
+        findings = []
+        for finding_details in chain.from_iterable(finding_details_batches):
+            recommendation_id = finding_details.get('recommendationId', '')
+            if recommendation_id in seen_recommendation_ids:
+                continue
+            seen_recommendation_ids.add(recommendation_id)
+            findings.append(Finding(finding_details))
+        return findings
+
     def get_findings(self, frameworks):
         """Filters provided findings by the provided frameworks.
 
+        All the frameworks are retrieved with a single query, paging through its results, instead of a query per
+        framework. The pages are requested at the maximum size resource graph allows, instead of its default of 100
+        rows, to keep the number of requests down. Resource graph only accepts a limited number of subscriptions per
+        query, so the subscriptions are queried in batches, a few of them concurrently.
+
         Args:
             frameworks: The frameworks to filter for
 
@@ -112,25 +280,21 @@ class DefenderForCloud:
             findings (list(Findings)): A list of findings matching the provided frameworks
 
         """
-        finding_details_set = set()
-        arg_client = arg.ResourceGraphClient(self._credential)
-        frameworks = DefenderForCloud.validate_frameworks(frameworks)
-        query_options = {'result_format': 'objectArray'}
-        for framework in frameworks:
-            done = False
-            while not done:
-                arg_query_options = arg.models.QueryRequestOptions(**query_options)
-                arg_query = arg.models.QueryRequest(subscriptions=self.subscription_list,
-                                                    query=FINDINGS_QUERY_STRING.format(framework=framework),
-                                                    options=arg_query_options)
-                response = arg_client.resources(arg_query)
-                for finding_details in response.data:
-                    finding_details_set.add(Finding(finding_details))
-                if response.skip_token:
-                    query_options.update({'skip_token': response.skip_token})
-                else:
-                    done = True
-        return list(finding_details_set)
+        import azure.mgmt.resourcegraph as arg  # pylint: disable=import-outside-toplevel
+        arg_client = arg.ResourceGraphClient(self._credential, transport=self._transport, **AZURE_CLIENT_RETRY_SETTINGS)
+        frameworks = tuple(sorted(DefenderForCloud.validate_frameworks(frameworks)))
+        query = build_findings_query(frameworks, self._get_denied_resource_groups_clause(self.denied_resource_group_names))
+        subscriptions = list(self.subscription_list)
+        batches = [subscriptions[index:index + RESOURCE_GRAPH_SUBSCRIPTIONS_BATCH_SIZE]
+                   for index in range(0, len(subscriptions), RESOURCE_GRAPH_SUBSCRIPTIONS_BATCH_SIZE)] or [subscriptions]
+        get_finding_details = partial(self._get_finding_details_for_subscriptions, arg_client, query)
+        if len(batches) == 1:
+            findings = self._get_unique_findings([get_finding_details(batches[0])])
+        else:
+            with ThreadPoolExecutor(max_workers=min(RESOURCE_GRAPH_MAX_CONCURRENT_QUERIES, len(batches))) as executor:
+                findings = self._get_unique_findings(executor.map(get_finding_details, batches))
+        self._logger.debug(f'Retrieved {len(findings)} findings for frameworks {", ".join(frameworks)}')
+        return findings
 
 
 class Tenant:
@@ -145,15 +309,18 @@ class Tenant:
                  resource_group_thresholds=RESOURCE_GROUP_THRESHOLDS,
                  allowed_subscription_ids=None,
                  denied_subscription_ids=None,
-                 denied_resource_group_names=None):
+                 denied_resource_group_names=None,
+                 transport=None):
         self._logger = logging.getLogger(f'{LOGGER_BASENAME}.{self.__class__.__name__}')
         self.tenant_id = tenant_id
         self.credential = credential
+        self._transport = transport
         self.thresholds = thresholds
         self.subscription_thresholds = subscription_thresholds
         self.resource_group_thresholds = resource_group_thresholds
         self.denied_resource_group_names = denied_resource_group_names
-        subscription_ids = [subscription.subscription_id for subscription in self.subscriptions]
+        self._subscriptions = None
+        subscription_ids = {subscription.subscription_id for subscription in self.subscriptions}
         allowed_subscription_ids, denied_subscription_ids = validate_allowed_denied_subscription_ids(
             allowed_subscription_ids,
             denied_subscription_ids)
@@ -172,20 +339,20 @@ class Tenant:
             tenant_subscription_ids: All the tenant subscription ids.
 
         Returns:
-            subscription_ids (list): A list of subscription ids that are part of the tenant.
+            subscription_ids (frozenset): A set of subscription ids that are part of the tenant.
 
         Raises:
             SubscriptionNotPartOfTenant: If subscription ids are not part of the current tenant.
 
         """
-        subscriptions_not_in_tenant = set(subscription_ids) - set(tenant_subscription_ids)
+        subscription_ids = frozenset(subscription_ids)
+        subscriptions_not_in_tenant = subscription_ids.difference(tenant_subscription_ids)
         if subscriptions_not_in_tenant:
             raise SubscriptionNotPartOfTenant(f'The following subscription ids provided are not part of the tenant :'
                                               f' {subscriptions_not_in_tenant}')
         return subscription_ids
 
     @property
-    @cached(cache=TTLCache(maxsize=1000, ttl=600))
     def subscriptions(self):
         """Subscriptions of the Tenant.
 
@@ -193,9 +360,18 @@ class Tenant:
             List of subscriptions retrieved
 
         """
-        subscription_client = SubscriptionClient(self.credential)
-        return [Subscription(self.credential, subscription_detail, self.denied_resource_group_names) for subscription_detail in
-                subscription_client.subscriptions.list() if subscription_detail.tenant_id == self.tenant_id]
+        if self._subscriptions is None:
+            from azure.mgmt.resource import SubscriptionClient  # pylint: disable=import-outside-toplevel
+            subscription_client = SubscriptionClient(self.credential,
+                                                     transport=self._transport,
+                                                     **AZURE_CLIENT_RETRY_SETTINGS)
+            self._subscriptions = [Subscription(self.credential,
+                                                subscription_detail,
+                                                self.denied_resource_group_names,
+                                                self._transport)
+                                   for subscription_detail in subscription_client.subscriptions.list()
+                                   if subscription_detail.tenant_id == self.tenant_id]
+        return self._subscriptions
 
     def get_allowed_subscriptions(self):
         """Retrieves allowed subscriptions based on an allow list.
@@ -249,9 +425,11 @@ class Tenant:
         """
         labeled_subscriptions = []
         self._logger.debug('Calculating on defender for cloud findings')
+        findings_by_subscription_id = group_findings(defender_for_cloud_findings, 'subscription_id')
         for subscription in self.subscriptions_to_be_labeled:
-            self._logger.debug(f'Calculating energy label for subscription {subscription.subscription_id}')
-            subscription.get_energy_label(defender_for_cloud_findings)
+            self._logger.debug('Calculating energy label for subscription %s', subscription.subscription_id)
+            subscription.get_energy_label(findings_by_subscription_id.get(normalize_name(subscription.subscription_id),
+                                                                          ()))
             labeled_subscriptions.append(subscription)
         return labeled_subscriptions
 
@@ -267,32 +445,37 @@ class Tenant:
         """
         if self._targeted_subscriptions_energy_label is None:
             labeled_subscriptions = self.get_labeled_targeted_subscriptions(defender_for_cloud_findings)
+            findings_by_subscription_id = group_findings(defender_for_cloud_findings, 'subscription_id')
             label_counter = Counter(
-                [subscription.get_energy_label(defender_for_cloud_findings).label for subscription in
-                 labeled_subscriptions])
+                [subscription.get_energy_label(
+                    findings_by_subscription_id.get(normalize_name(subscription.subscription_id), ())).label
+                 for subscription in labeled_subscriptions])
             number_of_subscriptions = len(labeled_subscriptions)
             self._logger.debug(f'Number of subscriptions calculated are {number_of_subscriptions}')
+            best_label, worst_label = min(label_counter), max(label_counter)
             subscription_sums = []
             labels = []
+            number_of_labeled_subscriptions = 0
             for threshold in self.thresholds:
                 label = threshold.get('label')
                 percentage = threshold.get('percentage')
                 labels.append(label)
                 subscription_sums.append(label_counter.get(label, 0))
-                self._logger.debug(f'Calculating for labels {labels} with threshold {percentage} '
-                                   f'and sums of {subscription_sums}')
-                if sum(subscription_sums) / number_of_subscriptions * 100 >= percentage:
-                    self._logger.debug(f'Found a match with label {label}')
+                number_of_labeled_subscriptions += subscription_sums[-1]
+                self._logger.debug('Calculating for labels %s with threshold %s and sums of %s',
+                                   labels, percentage, subscription_sums)
+                if number_of_labeled_subscriptions / number_of_subscriptions * 100 >= percentage:
+                    self._logger.debug('Found a match with label %s', label)
                     self._targeted_subscriptions_energy_label = AggregateSubscriptionEnergyLabel(label,
-                                                                                                 min(label_counter.keys()),
-                                                                                                 max(label_counter.keys()),
+                                                                                                 best_label,
+                                                                                                 worst_label,
                                                                                                  number_of_subscriptions)
                     break
             else:
                 self._logger.debug('Found no match with thresholds, using default worst label F.')
                 self._targeted_subscriptions_energy_label = AggregateSubscriptionEnergyLabel('F',
-                                                                                             min(label_counter.keys()),
-                                                                                             max(label_counter.keys()),
+                                                                                             best_label,
+                                                                                             worst_label,
                                                                                              number_of_subscriptions)
         return self._targeted_subscriptions_energy_label
 
@@ -314,22 +497,52 @@ class Tenant:
                                  coverage=f'{coverage_percentage:.2f}%')
 
 
-class FindingParserLabeler:
+class FindingParserLabeler(ABC):
+
+    __slots__ = ('_threshold', '_energy_label_cache')
+
+    def __init__(self, threshold):
+        self._threshold = threshold
+        self._energy_label_cache = None
+
+    @property
+    @abstractmethod
+    def _type(self):
+        """Type of the azure resource."""
+
+    @abstractmethod
+    def get_open_findings(self, findings):
+        """Findings for the entity."""
 
     @staticmethod
     def _get_open_findings(findings, attribute, match):
-        """Findings for the subscription."""
-        return [finding for finding in findings if getattr(finding, attribute).lower() == match.lower()]
+        """Lazily yields the findings for the subscription."""
+        match = normalize_name(match)
+        return (finding for finding in findings if normalize_name(getattr(finding, attribute) or '') == match)
+
+    @staticmethod
+    def _iterate_filtered_findings(findings, states=(), exclude_skipped=True):
+        states = frozenset(states)
+        return (finding for finding in findings
+                if not (exclude_skipped and finding.is_skipped) and finding.state not in states)
+
+    @staticmethod
+    def filter_findings(findings, states=(), exclude_skipped=True):
+        """Returns findings excluding those with specific states and optionally the skipped ones in a single pass.
+
+        This is the single point the findings pipeline is materialized, the other helpers lazily yield findings.
+        """
+        return list(FindingParserLabeler._iterate_filtered_findings(findings, states, exclude_skipped))
 
     @staticmethod
     def get_not_skipped_findings(findings):
-        """Not skipped findings for the subscription."""
-        return [finding for finding in findings if not finding.is_skipped]
+        """Lazily yields the not skipped findings for the subscription."""
+        return FindingParserLabeler._iterate_filtered_findings(findings)
 
     @staticmethod
     def exclude_findings_by_state(findings, states):
-        """Returns findings excluding those with specific states."""
-        return [finding for finding in findings if finding.state not in states]
+        """Lazily yields the findings excluding those with specific states."""
+        return FindingParserLabeler._iterate_filtered_findings(findings, states, exclude_skipped=False)
 
     @staticmethod
     def _get_energy_label(findings, threshold, type_, name):
@@ -351,18 +564,47 @@ class FindingParserLabeler:
                              name=name
                              ).energy_label
 
+    def _get_cached_energy_label(self, findings, states, name):
+        """Calculates the energy label for the entity, reusing the last one calculated for the same findings and states.
+
+        Exporting multiple data types labels the same entities with the same findings over and over, so the label
+        of the last findings object the entity was labeled with is kept. Findings are matched by identity.
+
+        Args:
+            findings: List of defender for cloud findings.
+            states: The states to filter findings out for.
+            name: The name of the entity.
+
+        Returns:
+            The energy label of the entity based on the provided configuration.
+
+        """
+        cache = self._energy_label_cache
+        if cache is None or cache[0] is not findings or cache[1] != states:
+            energy_label = self._get_energy_label(self.filter_findings(self.get_open_findings(findings), states),
+                                                  self._threshold, self._type, name)
+            cache = self._energy_label_cache = (findings, states, energy_label)
+        return cache[2]
+
 
 class Subscription(FindingParserLabeler):
     """Models the Azure subscription that can label itself."""
 
+    __slots__ = ('_credential', '_data', 'denied_resource_group_names', '_transport',
+                 '_resource_groups', '_exempted_policies', '_logger')
+
     def __init__(self,
                  credential,
                  data,
-                 denied_resource_group_names=None):
+                 denied_resource_group_names=None,
+                 transport=None):
+        super().__init__(SUBSCRIPTION_THRESHOLD_TABLE)
         self._credential = credential
         self._data = data
-        self._threshold = SUBSCRIPTION_THRESHOLDS
         self.denied_resource_group_names = denied_resource_group_names
+        self._transport = transport
+        self._resource_groups = None
+        self._exempted_policies = None
         self._logger = logging.getLogger(f'{LOGGER_BASENAME}.{self.__class__.__name__}')
 
     @property
@@ -396,20 +638,29 @@ class Subscription(FindingParserLabeler):
         return self._data.state
 
     @property
-    @cached(cache=TTLCache(maxsize=1000, ttl=600))
     def resource_groups(self):
         """Resource groups of this subscription."""
-        resource_group_client = ResourceManagementClient(self._credential,
-                                                         self.subscription_id)
-        return [ResourceGroup(resource_group_detail) for resource_group_detail in
-                resource_group_client.resource_groups.list() if resource_group_detail.name not in self.denied_resource_group_names]
+        if self._resource_groups is None:
+            from azure.mgmt.resource import ResourceManagementClient  # pylint: disable=import-outside-toplevel
+            resource_group_client = ResourceManagementClient(self._credential,
+                                                             self.subscription_id,
+                                                             transport=self._transport,
+                                                             **AZURE_CLIENT_RETRY_SETTINGS)
+            denied_resource_group_names = {normalize_name(name) for name in self.denied_resource_group_names or ()}
+            self._resource_groups = [ResourceGroup(resource_group_detail) for resource_group_detail in
+                                     resource_group_client.resource_groups.list()
+                                     if normalize_name(resource_group_detail.name) not in denied_resource_group_names]
+        return self._resource_groups
 
     @property
-    @cached(cache=TTLCache(maxsize=1000, ttl=600))
     def exempted_policies(self):
         """Policies exempted for this subscription."""
-        policy_client = PolicyClient(credential=self._credential, subscription_id=self.subscription_id, api_version="2020-07-01-preview")
-        return list(policy_client.policy_exemptions.list())
+        if self._exempted_policies is None:
+            from azure.mgmt.resource.policy import PolicyClient  # pylint: disable=import-outside-toplevel
+            policy_client = PolicyClient(credential=self._credential, subscription_id=self.subscription_id, api_version="2020-07-01-preview",
+                                         transport=self._transport, **AZURE_CLIENT_RETRY_SETTINGS)
+            self._exempted_policies = list(policy_client.policy_exemptions.list())
+        return self._exempted_policies
 
     def get_open_findings(self, findings):
         """Findings for the resource group."""
@@ -426,19 +677,19 @@ class Subscription(FindingParserLabeler):
             The energy label of the resource group based on the provided configuration.
 
         """
-        not_skipped_findings = self.get_not_skipped_findings(self.get_open_findings(findings))
-        return self._get_energy_label(self.exclude_findings_by_state(not_skipped_findings, states),
-                                      self._threshold, self._type, self.subscription_id)
+        return self._get_cached_energy_label(findings, states, self.subscription_id)
 
 
 class ResourceGroup(FindingParserLabeler):
     """Models the Azure subscription's resource group that can label itself."""
 
+    __slots__ = ('_data', '_logger')
+
     def __init__(self,
                  data
                  ):
+        super().__init__(RESOURCE_GROUP_THRESHOLD_TABLE)
         self._data = data
-        self._threshold = RESOURCE_GROUP_THRESHOLDS
         self._logger = logging.getLogger(f'{LOGGER_BASENAME}.{self.__class__.__name__}')
 
     @property
@@ -471,19 +722,23 @@ class ResourceGroup(FindingParserLabeler):
             The energy label of the resource group based on the provided configuration.
 
         """
-        not_skipped_findings = self.get_not_skipped_findings(self.get_open_findings(findings))
-        return self._get_energy_label(self.exclude_findings_by_state(not_skipped_findings, states),
-                                      self._threshold, self._type, self.name)
+        return self._get_cached_energy_label(findings, states, self.name)
 
 
 class Finding:
     """Models a finding."""
 
+    __slots__ = ('_data', '_status_change_date', '_days_open')
+
+    # Shared by all the findings, a tenant easily has tens of thousands of them to look a logger up for.
+    _logger = logging.getLogger(f'{LOGGER_BASENAME}.Finding')
+
     def __init__(self,
                  data
                  ):
         self._data = data
-        self._logger = logging.getLogger(f'{LOGGER_BASENAME}.{self.__class__.__name__}')
+        self._status_change_date = NOT_PARSED
+        self._days_open = None
 
     def __hash__(self):
         return hash(self.recommendation_id)
@@ -500,6 +755,11 @@ class Finding:
             raise ValueError('Not a Finding object')
         return hash(self) != hash(other)
 
+    @property
+    def data(self):
+        """The raw data of the finding as retrieved from resource graph."""
+        return self._data
+
     @property
     def compliance_standard_id(self):
         """Compliance standard id."""
@@ -598,12 +858,23 @@ class Finding:
 
     @property
     def status_change_date(self):
-        """Status Change Date."""
-        status_change_date = self._data.get('statusChangeDate', '').split('.')[0]
-        return self._parse_date_time(status_change_date)
+        """Status Change Date, parsed once as the days open of every finding are calculated for each label."""
+        if self._status_change_date is NOT_PARSED:
+            status_change_date = self._data.get('statusChangeDate', '').split('.')[0]
+            self._status_change_date = self._parse_date_time(status_change_date)
+        return self._status_change_date
 
     @staticmethod
     def _parse_date_time(datetime_string):
+        try:
+            date_time = datetime.fromisoformat(datetime_string)
+        except ValueError:
+            pass
+        else:
+            # Dates with an offset are made naive in UTC, like the dates without one they are compared with.
+            if date_time.tzinfo is not None:
+                date_time = date_time.astimezone(timezone.utc).replace(tzinfo=None)
+            return date_time
         try:
             return datetime.strptime(datetime_string, '%Y-%m-%dT%H:%M:%S')
         except ValueError:
@@ -611,15 +882,17 @@ class Finding:
 
     @property
     def days_open(self):
-        """Days open."""
-        status_change_date = self.status_change_date
-        current_time = datetime.now()
-        try:
-            return (current_time - status_change_date).days
-        except Exception:  # pylint: disable=broad-except
-            self._logger.exception('Could not calculate number of days open, '
-                                   'last or first observation date is missing.')
-            return -1
+        """Days open, calculated once as it is read for every label the finding contributes to and on export."""
+        if self._days_open is None:
+            status_change_date = self.status_change_date
+            current_time = datetime.now()
+            try:
+                self._days_open = (current_time - status_change_date).days
+            except Exception:  # pylint: disable=broad-except
+                self._logger.exception('Could not calculate number of days open, '
+                                       'last or first observation date is missing.')
+                self._days_open = -1
+        return self._days_open
 
     @property
     def is_skipped(self):
@@ -627,149 +900,52 @@ class Finding:
         return self.compliance_state.lower() == 'skipped'
 
 
-class DataExporter:
-    """Export Azure security data."""
-
-    #  pylint: disable=too-many-arguments
-    def __init__(self,
-                 export_types,
-                 id,  # pylint: disable=redefined-builtin
-                 energy_label,
-                 defender_for_cloud_findings,
-                 labeled_subscriptions,
-                 credentials=None):
-        self._id = id
-        self.energy_label = energy_label
-        self.defender_for_cloud_findings = defender_for_cloud_findings
-        self.labeled_subscriptions = labeled_subscriptions
-        self.export_types = export_types
-        self._credentials = credentials
-        self._logger = logging.getLogger(f'{LOGGER_BASENAME}.{self.__class__.__name__}')
-
-    def export(self, path):
-        """Exports the data to the provided path."""
-        destination = DestinationPath(path)
-        if not destination.is_valid():
-            raise InvalidPath(path)
-        for export_type in self.export_types:
-            data_file = DataFileFactory(export_type,
-                                        self._id,
-                                        self.energy_label,
-                                        self.defender_for_cloud_findings,
-                                        self.labeled_subscriptions)
-            if destination.type == 'blob':
-                self._export_to_blob(path, data_file.filename, data_file.json)  # pylint: disable=no-member
-            else:
-                self._export_to_fs(path, data_file.filename, data_file.json)  # pylint: disable=no-member
-
-    def _export_to_fs(self, directory, filename, data):
-        """Exports as json to local filesystem."""
-        path = Path(directory)
-        try:
-            path.mkdir()
-        except FileExistsError:
-            self._logger.debug(f'Directory {directory} already exists.')
-        with open(path.joinpath(filename), 'w', encoding='utf-8') as jsonfile:
-            jsonfile.write(data)
-        self._logger.info(f'File {filename} copied to {directory}')
-
-    def _export_to_blob(self, blob_url, filename, data):
-        """Exports as json to Blob container object storage."""
-        parsed_url = urlparse(blob_url)
-
-        account_url = blob_url if parsed_url.query else f'{parsed_url.scheme}://{parsed_url.netloc}/'
-        # If SAS Token is included in the URL, ommit credential parameter
-        credential = None if parsed_url.query else self._credentials
-        blob_service_client = BlobServiceClient(account_url=account_url,
-                                                credential=credential)
-        container = parsed_url.path.split('/')[1]
-        blob_client = blob_service_client.get_blob_client(container=container, blob=filename)
-
-        message = f'Export {filename} to blob {blob_url}'
-        try:
-            blob_client.upload_blob(data.encode('utf-8'), overwrite=True)
-            self._logger.info(f'{message} success')
-        except Exception:  # pylint: disable=broad-except
-            self._logger.exception(f'{message} failure')
-
-
-class DataFileFactory:
-    """Data export factory to handle the different data types returned."""
-
-    #  pylint: disable=too-many-arguments, unused-argument
-    def __new__(cls,
-                export_type,
-                id,  # pylint: disable=redefined-builtin
-                energy_label,
-                defender_for_cloud_findings,
-                labeled_subscriptions):
-        data_file_configuration = next((datafile for datafile in FILE_EXPORT_TYPES
-                                        if datafile.get('type') == export_type.lower()), None)
-
-        if not data_file_configuration:
-            LOGGER.error('Unknown data type %s', export_type)
-            return None
-        obj = data_file_configuration.get('object_type')
-        arguments = {'filename': data_file_configuration.get('filename')}
-        arguments.update({key: value for key, value in copy(locals()).items()
-                          if key in data_file_configuration.get('required_arguments')})
-        return obj(**arguments)
-
-
 class EnergyLabeler:
     """Generic EnergyLabel factory to return energy label for resource groups and subscriptions."""
 
+    # Shared by all the labelers, one is created for every subscription and resource group labeled.
+    _logger = logging.getLogger(f'{LOGGER_BASENAME}.EnergyLabeler')
+
     def __init__(self, object_type, name, findings, threshold):
         self.findings = findings
-        self.threshold = threshold
+        self.threshold = build_thresholds(threshold)
         self.name = name
         self.object_type = object_type
         self.energy_label_class = self._energy_label_class()
-        self._logger = logging.getLogger(f'{LOGGER_BASENAME}.{self.__class__.__name__}')
 
     def _energy_label_class(self):
-        config = next(
-            (config for config in ENERGY_LABEL_CALCULATION_CONFIG if config.get('object_type') == self.object_type),
-            None)
-        return config.get('energy_label_object', None)
+        return ENERGY_LABEL_CALCULATION_CONFIG.get(self.object_type)
 
     @property
     def energy_label(self):
         """Energy Label for the subscription or resource group."""
         if not self.findings:
             return self.energy_label_class('A', 0, 0, 0, 0)
-        counted_findings = Counter()
-        open_days_counter = Counter()
-        for finding in self.findings:
-            counted_findings[finding.severity] += 1
-            open_days_counter[finding.days_open] += 1
+        counted_findings = Counter(finding.severity for finding in self.findings)
         try:
             number_of_high_findings = counted_findings.get('High', 0)
             number_of_medium_findings = counted_findings.get('Medium', 0)
             number_of_low_findings = counted_findings.get('Low', 0)
-            max_days_open = max(open_days_counter)
-
-            self._logger.debug(f'Calculating for {self.object_type} {self.name} '
-                               f'with number of high findings '
-                               f'{number_of_high_findings}, '
-                               f'number of medium findings {number_of_medium_findings}, '
-                               f'number of low findings {number_of_low_findings}, '
-                               f'and findings have been open for over '
-                               f'{max_days_open} days'
-                               )
+            max_days_open = max(finding.days_open for finding in self.findings)
+
+            self._logger.debug('Calculating for %s %s with number of high findings %s, number of medium findings %s, '
+                               'number of low findings %s, and findings have been open for over %s days',
+                               self.object_type, self.name, number_of_high_findings, number_of_medium_findings,
+                               number_of_low_findings, max_days_open)
             for threshold in self.threshold:
-                if all([number_of_high_findings <= threshold['high'],
-                        number_of_medium_findings <= threshold['medium'],
-                        number_of_low_findings <= threshold['low'],
-                        max_days_open < threshold['days_open_less_than']]):
-                    energy_label = self.energy_label_class(threshold['label'],
+                if (number_of_high_findings <= threshold.high
+                        and number_of_medium_findings <= threshold.medium
+                        and number_of_low_findings <= threshold.low
+                        and max_days_open < threshold.days_open_less_than):
+                    energy_label = self.energy_label_class(threshold.label,
                                                            number_of_high_findings,
                                                            number_of_medium_findings,
                                                            number_of_low_findings,
                                                            max_days_open)
-                    self._logger.debug(f'Energy Label for {self.object_type} {self.name} '
-                                       f'has been calculated: {energy_label.label}')
+                    self._logger.debug('Energy Label for %s %s has been calculated: %s',
+                                       self.object_type, self.name, energy_label.label)
                     break
+            else:
                 self._logger.debug('No match with thresholds for energy label, using default worst one.')
                 energy_label = self.energy_label_class('F',
                                                        number_of_high_findings,
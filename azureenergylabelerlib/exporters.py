@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: exporters.py
+#
+# Copyright 2022 Sayantan Khanra
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Main code for exporters.
+
+.. _Google Python Style Guide:
+   https://google.github.io/styleguide/pyguide.html
+
+"""
+
+import gzip
+import logging
+from copy import copy
+from pathlib import Path
+from urllib.parse import urlparse
+from .configuration import (FILE_EXPORT_TYPES_BY_TYPE,
+                            BLOB_UPLOAD_MAX_CONCURRENCY)
+from .datamodels import GZIP_COMPRESSION_LEVEL
+from .validations import DestinationPath
+from .azureenergylabelerlibexceptions import InvalidPath
+
+__author__ = '''Sayantan Khanra <skhanra@schubergphilis.com>'''
+__docformat__ = '''google'''
+__date__ = '''22-04-2022'''
+__copyright__ = '''Copyright 2022, Sayantan Khanra'''
+__credits__ = ["Sayantan Khanra"]
+__license__ = '''MIT'''
+__maintainer__ = '''Sayantan Khanra'''
+__email__ = '''<skhanra@schubergphilis.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+LOGGER_BASENAME = '''exporters'''
+LOGGER = logging.getLogger(LOGGER_BASENAME)
+LOGGER.addHandler(logging.NullHandler())
+
+
+class DataExporter:
+    """Export Azure security data."""
+
+    #  pylint: disable=too-many-arguments
+    def __init__(self,
+                 export_types,
+                 id,  # pylint: disable=redefined-builtin
+                 energy_label,
+                 defender_for_cloud_findings,
+                 labeled_subscriptions,
+                 credentials=None,
+                 indent=None,
+                 compress=False):
+        self._id = id
+        self.energy_label = energy_label
+        self.defender_for_cloud_findings = defender_for_cloud_findings
+        self.labeled_subscriptions = labeled_subscriptions
+        self.export_types = export_types
+        self._credentials = credentials
+        self.indent = indent
+        self.compress = compress
+        self._logger = logging.getLogger(f'{LOGGER_BASENAME}.{self.__class__.__name__}')
+
+    def export(self, path):
+        """Exports the data to the provided path."""
+        destination = DestinationPath(path)
+        if not destination.is_valid():
+            raise InvalidPath(path)
+        for export_type in self.export_types:
+            data_file = DataFileFactory(export_type,
+                                        self._id,
+                                        self.energy_label,
+                                        self.defender_for_cloud_findings,
+                                        self.labeled_subscriptions,
+                                        self.indent)
+            if destination.type == 'blob':
+                self._export_to_blob(path, data_file.filename, data_file.json_bytes)  # pylint: disable=no-member
+            else:
+                self._export_to_fs(path, data_file)
+
+    def _export_to_fs(self, directory, data_file):
+        """Exports as json to local filesystem."""
+        path = Path(directory)
+        try:
+            path.mkdir()
+        except FileExistsError:
+            self._logger.debug(f'Directory {directory} already exists.')
+        filename = Path(data_file.write(path.joinpath(data_file.filename), self.compress)).name
+        self._logger.info(f'File {filename} copied to {directory}')
+
+    def _export_to_blob(self, blob_url, filename, data):
+        """Exports as json to Blob container object storage."""
+        parsed_url = urlparse(blob_url)
+
+        account_url = blob_url if parsed_url.query else f'{parsed_url.scheme}://{parsed_url.netloc}/'
+        # If SAS Token is included in the URL, ommit credential parameter
+        credential = None if parsed_url.query else self._credentials
+        from azure.storage.blob import BlobServiceClient  # pylint: disable=import-outside-toplevel
+        blob_service_client = BlobServiceClient(account_url=account_url,
+                                                credential=credential)
+        container = parsed_url.path.split('/')[1]
+        if self.compress:
+            filename = f'{filename}.gz'
+            data = gzip.compress(data, compresslevel=GZIP_COMPRESSION_LEVEL)
+        blob_client = blob_service_client.get_blob_client(container=container, blob=filename)
+
+        message = f'Export {filename} to blob {blob_url}'
+        try:
+            blob_client.upload_blob(data, overwrite=True, max_concurrency=BLOB_UPLOAD_MAX_CONCURRENCY)
+            self._logger.info(f'{message} success')
+        except Exception:  # pylint: disable=broad-except
+            self._logger.exception(f'{message} failure')
+
+
+class DataFileFactory:
+    """Data export factory to handle the different data types returned."""
+
+    #  pylint: disable=too-many-arguments, unused-argument
+    def __new__(cls,
+                export_type,
+                id,  # pylint: disable=redefined-builtin
+                energy_label,
+                defender_for_cloud_findings,
+                labeled_subscriptions,
+                indent=None):
+        data_file_configuration = FILE_EXPORT_TYPES_BY_TYPE.get(export_type.lower())
+
+        if not data_file_configuration:
+            LOGGER.error('Unknown data type %s', export_type)
+            return None
+        obj = data_file_configuration.get('object_type')
+        arguments = {'filename': data_file_configuration.get('filename'), 'indent': indent}
+        arguments.update({key: value for key, value in copy(locals()).items()
+                          if key in data_file_configuration.get('required_arguments')})
+        return obj(**arguments)
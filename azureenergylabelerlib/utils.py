@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: utils.py
+#
+# Copyright 2022 Sayantan Khanra
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Main code for utils.
+
+.. _Google Python Style Guide:
+   https://google.github.io/styleguide/pyguide.html
+
+"""
+
+import logging
+import re
+import sys
+from collections import defaultdict, namedtuple
+from functools import lru_cache
+
+__author__ = '''Sayantan Khanra <skhanra@schubergphilis.com>'''
+__docformat__ = '''google'''
+__date__ = '''22-04-2022'''
+__copyright__ = '''Copyright 2022, Sayantan Khanra'''
+__credits__ = ["Sayantan Khanra"]
+__license__ = '''MIT'''
+__maintainer__ = '''Sayantan Khanra'''
+__email__ = '''<skhanra@schubergphilis.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+LOGGER_BASENAME = '''utils'''
+LOGGER = logging.getLogger(LOGGER_BASENAME)
+LOGGER.addHandler(logging.NullHandler())
+
+QUERY_TOKEN_PATTERN = re.compile(r"""("[^"]*"|'[^']*')|\s+""")
+
+# The last findings tuple grouped per attribute and its grouping, see group_findings.
+LAST_FINDINGS_GROUPINGS = {}
+
+
+def minify_query(query):
+    """Collapses the whitespace of a query outside of its string literals.
+
+    The query language ignores whitespace between tokens, so the indentation that keeps the queries readable in
+    code only inflates every request sent to the service.
+
+    Args:
+        query: The query to minify.
+
+    Returns:
+        query (str): The query with every run of whitespace outside of its string literals collapsed to a space.
+
+    """
+    return QUERY_TOKEN_PATTERN.sub(lambda match: match.group(1) or ' ', query).strip()
+
+
+Threshold = namedtuple('Threshold', 'label high medium low days_open_less_than')
+
+
+@lru_cache(maxsize=8192)
+def normalize_name(name):
+    """Lowercases and interns a name so it can be compared case insensitively.
+
+    Resource group names have a very low cardinality compared to the findings referencing them, so the result is
+    memoized instead of lowercasing the same few names over and over.
+
+    Args:
+        name: The name to normalize.
+
+    Returns:
+        name (str): The lowercase interned name.
+
+    """
+    return sys.intern(name.lower())
+
+
+def build_thresholds(thresholds):
+    """Builds an immutable threshold table out of a list of threshold dictionaries.
+
+    Args:
+        thresholds: The thresholds as dictionaries or Threshold tuples.
+
+    Returns:
+        thresholds (tuple(Threshold)): The thresholds as Threshold tuples.
+
+    """
+    return tuple(threshold if isinstance(threshold, Threshold) else Threshold(**threshold)
+                 for threshold in thresholds)
+
+
+def group_findings(findings, attribute):
+    """Groups findings by the normalized value of one of their attributes in a single pass.
+
+    Labeling many entities can then look up the findings of each entity instead of scanning all the findings for
+    every one of them.
+
+    The findings of a labeler run are an immutable tuple that the tenant and every export group the same way, so the
+    last grouping of such a tuple is kept per attribute and handed out again. The entities then get the very same
+    findings lists and reuse the energy labels they already calculated for them. Other iterables may change between
+    calls and are grouped every time.
+
+    Args:
+        findings: The findings to group.
+        attribute: The attribute of the findings to group on.
+
+    Returns:
+        grouped_findings (dict): The lists of findings keyed by the normalized value of the attribute.
+
+    """
+    if not isinstance(findings, tuple):
+        return _group_findings(findings, attribute)
+    last_findings, grouped_findings = LAST_FINDINGS_GROUPINGS.get(attribute, (None, None))
+    if last_findings is not findings:
+        grouped_findings = _group_findings(findings, attribute)
+        LAST_FINDINGS_GROUPINGS[attribute] = (findings, grouped_findings)
+    return grouped_findings
+
+
+def _group_findings(findings, attribute):
+    grouped_findings = defaultdict(list)
+    for finding in findings:
+        grouped_findings[normalize_name(getattr(finding, attribute) or '')].append(finding)
+    return dict(grouped_findings)
@@ -38,6 +38,7 @@ setup(
                  '''azureenergylabelerlib'''},
     include_package_data=True,
     install_requires=requirements,
+    extras_require={'orjson': ['orjson>=3.8.0,<4.0']},
     license='MIT',
     zip_safe=False,
     keywords='''azureenergylabelerlib ''',
@@ -33,8 +33,55 @@ Tests for `azureenergylabelerlib` module.
 
 """
 
+import gzip
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+from functools import partial
+from itertools import chain
+from operator import attrgetter
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import TestCase, mock
+
+from azure.core.exceptions import HttpResponseError
 from betamax.fixtures import unittest
 
+from azureenergylabelerlib.azureenergylabelerlib import AzureEnergyLabeler
+from azureenergylabelerlib.azureenergylabelerlibexceptions import InvalidResourceGroupListProvided
+from azureenergylabelerlib.cache import FindingsDiskCache
+from azureenergylabelerlib.configuration import (FINDINGS_CACHE_DISABLE_VARIABLE,
+                                                 DENIED_RESOURCE_GROUPS_QUERY_CHUNK_SIZE,
+                                                 RESOURCE_GRAPH_THROTTLING_RETRIES,
+                                                 RESOURCE_GRAPH_THROTTLING_DEFAULT_WAIT,
+                                                 RESOURCE_GRAPH_THROTTLING_WAIT_MARGIN,
+                                                 RESOURCE_GRAPH_PAGE_SIZE,
+                                                 RESOURCE_ID_PATTERN,
+                                                 SUBSCRIPTION_THRESHOLDS,
+                                                 RESOURCE_GRAPH_SUBSCRIPTIONS_BATCH_SIZE)
+from azureenergylabelerlib.datamodels import (DefenderForCloudFindingsData,
+                                              FINDING_EXPORT_COLUMN_NAMES,
+                                              SubscriptionExemptedPolicies,
+                                              to_json,
+                                              write_json_rows,
+                                              TenantEnergyLabelingData,
+                                              LabeledSubscriptionsData,
+                                              LabeledResourceGroupsData,
+                                              SUBSCRIPTIONS_DATA_MAX_WORKERS)
+from azureenergylabelerlib.entities import (Finding,
+                                            DefenderForCloud,
+                                            build_findings_query,
+                                            Subscription,
+                                            EnergyLabeler,
+                                            ResourceGroup,
+                                            Tenant,
+                                            SUBSCRIPTION_THRESHOLD_TABLE,
+                                            FindingParserLabeler)
+from azureenergylabelerlib.labels import TenantEnergyLabel
+from azureenergylabelerlib.utils import build_thresholds, group_findings, normalize_name
+
 __author__ = '''Sayantan Khanra <skhanra@schubergphilis.com>'''
 __docformat__ = '''google'''
 __date__ = '''22-04-2022'''
@@ -63,3 +110,489 @@ class TestAzureenergylabelerlib(unittest.BetamaxTestCase):
         This is where you should tear down what you've setup in setUp before. This method is called after every test.
         """
         pass
+
+
+FINDINGS_DATA = [{'recommendationId': 'first',
+                  'subscriptionId': '00000000-0000-0000-0000-000000000000',
+                  'resourceGroup': 'Résumé',
+                  'severity': 'High',
+                  'complianceState': 'Failed',
+                  'statusChangeDate': '2022-04-22T10:00:00.123Z'},
+                 {'recommendationId': 'second',
+                  'subscriptionId': '00000000-0000-0000-0000-000000000000',
+                  'resourceGroup': 'rg',
+                  'severity': 'Low',
+                  'complianceState': 'Skipped',
+                  'statusChangeDate': '2022-04-22T10:00:00Z'}]
+class TestFindingsDiskCache(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_directory = Path(self.directory.name, 'cache')
+        self.findings = [Finding(data) for data in FINDINGS_DATA]
+        self.key = FindingsDiskCache.get_key('tenant', ['framework'], ['subscription'])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_disabled_by_default(self):
+        cache = FindingsDiskCache(self.cache_directory)
+        cache.set(self.key, self.findings)
+        self.assertFalse(self.cache_directory.exists())
+        self.assertIsNone(cache.get(self.key))
+
+    def test_disabled_by_environment(self):
+        cache = FindingsDiskCache(self.cache_directory, ttl=60)
+        with mock.patch.dict(os.environ, {FINDINGS_CACHE_DISABLE_VARIABLE: '1'}):
+            cache.set(self.key, self.findings)
+            self.assertIsNone(cache.get(self.key))
+        self.assertFalse(self.cache_directory.exists())
+
+    def test_get_set(self):
+        cache = FindingsDiskCache(self.cache_directory, ttl=60)
+        self.assertIsNone(cache.get(self.key))
+        cache.set(self.key, self.findings)
+        self.assertEqual([finding.data for finding in cache.get(self.key)], FINDINGS_DATA)
+        self.assertEqual(os.listdir(self.cache_directory), [f'{self.key}.json'])
+        self.assertEqual(self.cache_directory.stat().st_mode & 0o777, 0o700)
+        self.assertEqual(self.cache_directory.joinpath(f'{self.key}.json').stat().st_mode & 0o777, 0o600)
+
+    def test_expiry(self):
+        cache = FindingsDiskCache(self.cache_directory, ttl=60)
+        cache.set(self.key, self.findings)
+        expired = time.time() - 61
+        os.utime(self.cache_directory.joinpath(f'{self.key}.json'), (expired, expired))
+        self.assertIsNone(cache.get(self.key))
+
+    def test_key(self):
+        self.assertEqual(self.key, FindingsDiskCache.get_key('tenant', {'framework'}, ('subscription',), []))
+        self.assertNotEqual(self.key, FindingsDiskCache.get_key('tenant', ['framework'], ['subscription'], ['rg']))
+
+
+class TestDeniedResourceGroups(TestCase):
+
+    def test_clause(self):
+        get_clause = DefenderForCloud._get_denied_resource_groups_clause  # pylint: disable=protected-access
+        self.assertEqual(get_clause(None), '')
+        self.assertEqual(get_clause(['RG-B', 'rg-a', 'rg-b']), " | where resourceGroup1 !in~ ('rg-a', 'rg-b')")
+
+    def test_clause_is_chunked(self):
+        get_clause = DefenderForCloud._get_denied_resource_groups_clause  # pylint: disable=protected-access
+        names = [f'rg-{index:04}' for index in range(DENIED_RESOURCE_GROUPS_QUERY_CHUNK_SIZE + 1)]
+        clause = get_clause(names)
+        self.assertEqual(clause.count('resourceGroup1 !in~'), 2)
+        self.assertTrue(all(f"'{name}'" in clause for name in names))
+
+    def test_invalid_names_are_rejected(self):
+        for names in (["a'b"], ['rg) or true or (1']):
+            with self.assertRaises(InvalidResourceGroupListProvided):
+                DefenderForCloud(None, ['subscription'], denied_resource_group_names=names)
+            with self.assertRaises(InvalidResourceGroupListProvided):
+                DefenderForCloud._get_denied_resource_groups_clause(names)  # pylint: disable=protected-access
+
+    def test_findings_query_excludes_denied_resource_groups_early(self):
+        defender_for_cloud = DefenderForCloud(None, ['subscription'], denied_resource_group_names=['Denied'])
+        client = mock.MagicMock()
+        client.resources.return_value = mock.MagicMock(data=[], skip_token=None)
+        with mock.patch('azure.mgmt.resourcegraph.ResourceGraphClient', return_value=client):
+            self.assertEqual(list(defender_for_cloud.get_findings(frameworks=['Azure CIS 1.1.0'])), [])
+        query = client.resources.call_args[0][0].query
+        self.assertIn('"Azure CIS 1.1.0"', query)
+        clause_position = query.index("| where resourceGroup1 !in~ ('denied')")
+        self.assertLess(clause_position, query.index('mvexpand'))
+        self.assertLess(clause_position, query.index('order by'))
+        self.assertNotIn('{denied_resource_groups}', query)
+        self.assertNotIn('{denied_resource_groups}', build_findings_query(('Azure CIS 1.1.0',)))
+
+
+def get_throttling_error(status_code):
+    response = mock.MagicMock(status_code=status_code, headers={'x-ms-user-quota-resets-after': '00:00:02'})
+    error = HttpResponseError(response=response)
+    error.status_code = status_code
+    return error
+
+
+class TestResourceGraphThrottling(TestCase):
+
+    def setUp(self):
+        self.defender_for_cloud = DefenderForCloud(None, ['subscription'])
+        self.client = mock.MagicMock()
+
+    @mock.patch('azureenergylabelerlib.entities.time.sleep')
+    def test_query_resources_retries_when_throttled(self, sleep):
+        self.client.resources.side_effect = [get_throttling_error(429), get_throttling_error(429), 'response']
+        self.assertEqual(self.defender_for_cloud._query_resources(self.client, 'query'), 'response')  # pylint: disable=protected-access
+        self.assertEqual(self.client.resources.call_count, 3)
+        self.assertEqual(sleep.call_args_list, [mock.call(2 + RESOURCE_GRAPH_THROTTLING_WAIT_MARGIN)] * 2)
+
+    @mock.patch('azureenergylabelerlib.entities.time.sleep')
+    def test_query_resources_raises_when_still_throttled(self, sleep):
+        self.client.resources.side_effect = get_throttling_error(429)
+        with self.assertRaises(HttpResponseError):
+            self.defender_for_cloud._query_resources(self.client, 'query')  # pylint: disable=protected-access
+        self.assertEqual(self.client.resources.call_count, RESOURCE_GRAPH_THROTTLING_RETRIES)
+        self.assertEqual(sleep.call_count, RESOURCE_GRAPH_THROTTLING_RETRIES - 1)
+
+    @mock.patch('azureenergylabelerlib.entities.time.sleep')
+    def test_query_resources_does_not_retry_other_errors(self, sleep):
+        self.client.resources.side_effect = get_throttling_error(500)
+        with self.assertRaises(HttpResponseError):
+            self.defender_for_cloud._query_resources(self.client, 'query')  # pylint: disable=protected-access
+        self.assertEqual(self.client.resources.call_count, 1)
+        sleep.assert_not_called()
+
+    def test_quota_resets_after(self):
+        get_quota_resets_after = DefenderForCloud._get_quota_resets_after  # pylint: disable=protected-access
+        self.assertEqual(get_quota_resets_after({'x-ms-user-quota-resets-after': '01:02:03.5'}), 3723.5)
+        self.assertEqual(get_quota_resets_after({}), RESOURCE_GRAPH_THROTTLING_DEFAULT_WAIT)
+        self.assertEqual(get_quota_resets_after({'x-ms-user-quota-resets-after': 'soon'}),
+                         RESOURCE_GRAPH_THROTTLING_DEFAULT_WAIT)
+
+
+class ExportTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name, 'findings.json')
+        self.findings = [Finding(data) for data in FINDINGS_DATA]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+class TestExportWrite(ExportTestCase):
+
+    def test_write_round_trips(self):
+        for indent in (None, 2, 4):
+            data_file = DefenderForCloudFindingsData(self.path.name, self.findings, indent=indent)
+            path = data_file.write(self.path)
+            with open(path, 'r', encoding='utf-8') as json_file:
+                content = json_file.read()
+            self.assertEqual(json.loads(content), data_file.data)
+            self.assertEqual(content, data_file.json)
+            self.assertEqual(content.encode('utf-8'), data_file.json_bytes)
+            self.assertEqual('\n' in content, bool(indent))
+
+    def test_write_skips_skipped_findings(self):
+        data_file = DefenderForCloudFindingsData(self.path.name, self.findings)
+        self.assertEqual([row['Recommendation ID'] for row in data_file.data], ['first'])
+
+
+class TestColumnarFindingsExport(ExportTestCase):
+
+    def test_write_columnar(self):
+        data_file = DefenderForCloudFindingsData(self.path.name, self.findings, columnar=True)
+        with open(data_file.write(self.path), 'r', encoding='utf-8') as json_file:
+            data = json.load(json_file)
+        self.assertEqual(data['columns'], list(FINDING_EXPORT_COLUMN_NAMES))
+        rows = DefenderForCloudFindingsData(self.path.name, self.findings).data
+        self.assertEqual([dict(zip(data['columns'], row)) for row in data['rows']], rows)
+
+
+class TestCompressedExport(ExportTestCase):
+
+    def test_write_compressed(self):
+        for indent in (None, 2, 4):
+            data_file = DefenderForCloudFindingsData(self.path.name, self.findings, indent=indent)
+            path = data_file.write(self.path, compress=True)
+            self.assertEqual(path, f'{self.path}.gz')
+            with gzip.open(path, 'rt', encoding='utf-8') as json_file:
+                self.assertEqual(json_file.read(), data_file.json)
+
+
+class TestStreamedExport(ExportTestCase):
+
+    def test_write_json_rows_matches_the_json_of_the_rows(self):
+        rows = [{'name': 'Résumé', 'values': [1, None]}, {'name': 'second', 'values': []}]
+        for indent in (None, 2, 4):
+            for compress in (False, True):
+                for written_rows in (rows, []):
+                    write_json_rows(iter(written_rows), self.path, indent, compress)
+                    open_file = gzip.open if compress else open
+                    with open_file(self.path, 'rt', encoding='utf-8') as json_file:
+                        content = json_file.read()
+                    self.assertEqual(json.loads(content), written_rows)
+                    self.assertEqual(content, to_json(written_rows, indent))
+
+    def test_exempted_policies_streamed(self):
+        system_data = SimpleNamespace(created_at=datetime(2022, 4, 22), created_by='creator',
+                                      last_modified_at=None, last_modified_by=None)
+        exempted_policy = SimpleNamespace(system_data=system_data, description='description', display_name='Résumé',
+                                          exemption_category='Waiver', name='exemption', expires_on=None)
+        subscription = SimpleNamespace(subscription_id='subscription', exempted_policies=[exempted_policy])
+        data_file = SubscriptionExemptedPolicies(self.path.name, [subscription], indent=2)
+        with open(data_file.write(self.path), 'r', encoding='utf-8') as json_file:
+            data = json.load(json_file)
+        self.assertEqual(data, data_file.data)
+        self.assertEqual(data[0]['Created At'], '2022-04-22 00:00:00')
+
+
+class TestEnergyLabelCache(TestCase):
+
+    def setUp(self):
+        self.findings = [Finding(data) for data in FINDINGS_DATA]
+        self.subscription = Subscription(None, SimpleNamespace(subscription_id=FINDINGS_DATA[0]['subscriptionId']))
+
+    def test_label_is_reused_for_the_same_findings(self):
+        with mock.patch('azureenergylabelerlib.entities.EnergyLabeler', wraps=EnergyLabeler) as labeler:
+            first = self.subscription.get_energy_label(self.findings)
+            self.assertIs(self.subscription.get_energy_label(self.findings), first)
+            self.assertEqual(labeler.call_count, 1)
+            self.subscription.get_energy_label(list(self.findings))
+            self.assertEqual(labeler.call_count, 2)
+            self.subscription.get_energy_label(self.findings, states=())
+            self.assertEqual(labeler.call_count, 3)
+
+
+class TestLabelingRunCalculatesEveryLabelOnce(TestCase):
+
+    def setUp(self):
+        self.subscriptions = []
+        findings = []
+        for index in range(3):
+            subscription_id = f'{index:08d}-0000-0000-0000-000000000000'
+            subscription = Subscription(None, SimpleNamespace(subscription_id=subscription_id,
+                                                              display_name=f'subscription{index}'))
+            subscription._resource_groups = [ResourceGroup(SimpleNamespace(name=f'RG{index}{group}', location='westeurope'))  # pylint: disable=protected-access
+                                             for group in range(2)]
+            subscription._exempted_policies = []  # pylint: disable=protected-access
+            self.subscriptions.append(subscription)
+            findings.extend(Finding({'recommendationId': f'{index}{group}',
+                                     'subscriptionId': subscription_id,
+                                     'resourceGroup': f'rg{index}{group}',
+                                     'severity': 'High',
+                                     'complianceState': 'Failed',
+                                     'statusChangeDate': '2022-04-22T10:00:00Z'}) for group in range(2))
+        self.findings = tuple(findings)
+
+    def test_exports_reuse_the_labels_of_the_run(self):
+        with mock.patch.object(Tenant, 'subscriptions', new_callable=mock.PropertyMock) as subscriptions, \
+                mock.patch('azureenergylabelerlib.entities.EnergyLabeler', wraps=EnergyLabeler) as labeler:
+            subscriptions.return_value = self.subscriptions
+            tenant = Tenant(None, 'tenant')
+            energy_label = tenant.get_energy_label(self.findings)
+            labeled_subscriptions = tenant.get_labeled_targeted_subscriptions(self.findings)
+            self.assertEqual(labeler.call_count, len(self.subscriptions))
+            for _ in range(2):
+                tenant_data = TenantEnergyLabelingData('tenant.json', 'tenant', energy_label.label, labeled_subscriptions,
+                                                       self.findings).data
+                subscriptions_data = LabeledSubscriptionsData('subscriptions.json', labeled_subscriptions, self.findings).data
+                resource_groups = LabeledResourceGroupsData('resource_groups.json', labeled_subscriptions,
+                                                            self.findings).data
+            self.assertEqual(labeler.call_count, len(self.subscriptions) + len(resource_groups))
+            self.assertEqual(tenant_data[0]['Labeled subscriptions'], subscriptions_data)
+            self.assertTrue(all(resource_group['Number of high findings'] == 1 for resource_group in resource_groups))
+
+
+class TestFindingsPaging(TestCase):
+
+    def test_all_pages_are_retrieved(self):
+        rows = [{'id': f'/assessments/{index}',
+                 'recommendationId': f'recommendation{index}',
+                 'subscriptionId': 'subscription'} for index in range(RESOURCE_GRAPH_PAGE_SIZE * 2 + 500)]
+        pages = [rows[index:index + RESOURCE_GRAPH_PAGE_SIZE] for index in range(0, len(rows), RESOURCE_GRAPH_PAGE_SIZE)]
+        client = mock.MagicMock()
+        client.resources.side_effect = [mock.MagicMock(data=page, skip_token=f'token{index}' if index < len(pages) - 1 else None)
+                                        for index, page in enumerate(pages)]
+        with mock.patch('azure.mgmt.resourcegraph.ResourceGraphClient', return_value=client):
+            findings = DefenderForCloud(None, ['subscription']).get_findings(frameworks=['Azure CIS 1.1.0'])
+        self.assertEqual([finding.recommendation_id for finding in findings], [row['recommendationId'] for row in rows])
+        requests = [call[0][0] for call in client.resources.call_args_list]
+        self.assertEqual([request.options.top for request in requests], [RESOURCE_GRAPH_PAGE_SIZE] * len(pages))
+        self.assertEqual([request.options.skip_token for request in requests], [None, 'token0', 'token1'])
+
+    def test_rows_are_identified_and_ordered_for_paging(self):
+        query = build_findings_query(('Azure CIS 1.1.0',))
+        self.assertIn('| project id, firstEvaluationDate,', query)
+        self.assertIn('| order by complianceControlId asc, recommendationId asc', query)
+
+
+class TestSharedTransport(TestCase):
+
+    def test_connection_pool_fits_the_concurrent_workers(self):
+        labeler = AzureEnergyLabeler('tenant')
+        adapter = labeler._shared_transport.session.get_adapter('https://management.azure.com')  # pylint: disable=protected-access
+        self.assertGreaterEqual(adapter._pool_maxsize, SUBSCRIPTIONS_DATA_MAX_WORKERS)  # pylint: disable=protected-access
+        self.assertIs(labeler._shared_transport, labeler._shared_transport)  # pylint: disable=protected-access
+
+    def test_closing_closes_the_session(self):
+        labeler = AzureEnergyLabeler('tenant')
+        transport = labeler._shared_transport  # pylint: disable=protected-access
+        with mock.patch.object(transport.session, 'close') as close:
+            with labeler:
+                pass
+        close.assert_called_once_with()
+        self.assertIsNone(transport.session)
+
+
+class TestResourceIdPattern(TestCase):
+
+    def test_resource_type_and_name(self):
+        self.assertEqual(RESOURCE_ID_PATTERN.search('/subscriptions/id/resourcegroups/rg/providers/microsoft.compute/'
+                                                    'virtualmachines/vm').groups(),
+                         (None, 'virtualmachines', 'vm'))
+        self.assertEqual(RESOURCE_ID_PATTERN.search('/subscriptions/id/resourcegroups/rg/providers/microsoft.sql/'
+                                                    'servers/server/databases/database').groups(),
+                         ('servers', 'databases', 'database'))
+        self.assertIn(RESOURCE_ID_PATTERN.pattern, build_findings_query(('Azure CIS 1.1.0',)))
+
+
+class TestFindingDates(TestCase):
+
+    @staticmethod
+    def get_finding(status_change_date):
+        return Finding({'recommendationId': 'recommendation', 'statusChangeDate': status_change_date})
+
+    def test_dates_are_naive_utc(self):
+        for status_change_date in ('2022-04-22T10:00:00.1234567Z', '2022-04-22T12:00:00+02:00', '2022-04-22T10:00:00'):
+            self.assertEqual(self.get_finding(status_change_date).status_change_date, datetime(2022, 4, 22, 10))
+        self.assertGreater(self.get_finding('2022-04-22T12:00:00+02:00').days_open, 0)
+
+    def test_unparsable_date_is_parsed_once(self):
+        finding = self.get_finding('not a date')
+        with mock.patch.object(Finding, '_parse_date_time', return_value=None) as parse_date_time:
+            self.assertIsNone(finding.status_change_date)
+            self.assertIsNone(finding.status_change_date)
+        parse_date_time.assert_called_once_with('not a date')
+        with self.assertLogs('entities.Finding', level='ERROR'):
+            self.assertEqual(finding.days_open, -1)
+
+
+def get_severity_findings(high=0, medium=0, low=0, days_open=0):
+    return [SimpleNamespace(severity=severity, days_open=days_open)
+            for severity, number in (('High', high), ('Medium', medium), ('Low', low)) for _ in range(number)]
+
+
+class TestEnergyLabeler(TestCase):
+
+    @staticmethod
+    def get_label(findings, threshold=SUBSCRIPTION_THRESHOLD_TABLE):
+        return EnergyLabeler('subscription', 'subscription', findings, threshold).energy_label
+
+    def test_threshold_boundaries(self):
+        for label, findings in (('A', get_severity_findings(medium=10, low=20)),
+                                ('B', get_severity_findings(medium=11)),
+                                ('B', get_severity_findings(high=10, medium=20, low=40)),
+                                ('C', get_severity_findings(high=11)),
+                                ('C', get_severity_findings(high=15, medium=30, low=60)),
+                                ('D', get_severity_findings(high=16)),
+                                ('D', get_severity_findings(high=20, medium=40, low=80)),
+                                ('E', get_severity_findings(high=21)),
+                                ('E', get_severity_findings(high=25, medium=50, low=100)),
+                                ('F', get_severity_findings(high=26)),
+                                ('F', get_severity_findings(low=1, days_open=999))):
+            self.assertEqual(self.get_label(findings).label, label)
+            self.assertEqual(self.get_label(findings, SUBSCRIPTION_THRESHOLDS), self.get_label(findings))
+
+    def test_threshold_tables(self):
+        self.assertEqual(SUBSCRIPTION_THRESHOLD_TABLE, build_thresholds(SUBSCRIPTION_THRESHOLDS))
+        self.assertEqual([threshold.label for threshold in SUBSCRIPTION_THRESHOLD_TABLE], ['A', 'B', 'C', 'D', 'E'])
+        self.assertIs(build_thresholds(SUBSCRIPTION_THRESHOLD_TABLE)[0], SUBSCRIPTION_THRESHOLD_TABLE[0])
+
+    def test_worst_label_when_no_threshold_matches(self):
+        energy_label = self.get_label(get_severity_findings(high=30, medium=1, low=2, days_open=5))
+        self.assertEqual((energy_label.label, energy_label.number_of_high_findings, energy_label.number_of_medium_findings,
+                          energy_label.number_of_low_findings, energy_label.max_days_open), ('F', 30, 1, 2, 5))
+        self.assertEqual(self.get_label(get_severity_findings(), ()).label, 'A')
+        self.assertEqual(self.get_label(get_severity_findings(low=1), ()).label, 'F')
+
+    def test_severities_are_counted(self):
+        findings = get_severity_findings(high=2, medium=3, low=4, days_open=1) + [SimpleNamespace(severity='Unknown', days_open=7)]
+        energy_label = self.get_label(findings)
+        self.assertEqual((energy_label.number_of_high_findings, energy_label.number_of_medium_findings,
+                          energy_label.number_of_low_findings, energy_label.max_days_open), (2, 3, 4, 7))
+
+
+class TestSubscriptionLabeling(TestCase):
+
+    def setUp(self):
+        self.subscriptions = [Subscription(None, SimpleNamespace(subscription_id=f'{index:08d}-aaaa-0000-0000-000000000000'))
+                              for index in range(3)]
+        findings = []
+        status_change_date = datetime.now().isoformat(timespec='seconds')
+        for index, subscription in enumerate(self.subscriptions):
+            subscription_id = subscription.subscription_id.upper() if index % 2 else subscription.subscription_id
+            findings.extend(Finding({'recommendationId': f'{index}{number}',
+                                     'subscriptionId': subscription_id,
+                                     'severity': 'High',
+                                     'complianceState': 'Failed',
+                                     'statusChangeDate': status_change_date}) for number in range(index * 11))
+        self.findings = tuple(findings)
+
+    def test_grouped_findings_label_like_scanning_all_findings(self):
+        with mock.patch.object(Tenant, 'subscriptions', new_callable=mock.PropertyMock) as subscriptions:
+            subscriptions.return_value = self.subscriptions
+            labeled_subscriptions = Tenant(None, 'tenant').get_labeled_targeted_subscriptions(self.findings)
+        findings_by_subscription_id = group_findings(self.findings, 'subscription_id')
+        labels = [subscription.get_energy_label(findings_by_subscription_id.get(normalize_name(subscription.subscription_id), ()))
+                  for subscription in labeled_subscriptions]
+        self.assertEqual([(label.label, label.number_of_high_findings) for label in labels], [('A', 0), ('C', 11), ('E', 22)])
+        for subscription, label in zip(labeled_subscriptions, labels):
+            unlabeled = Subscription(None, SimpleNamespace(subscription_id=subscription.subscription_id))
+            self.assertEqual(unlabeled.get_energy_label(list(self.findings)), label)
+
+
+class TestFindingsBatching(TestCase):
+
+    def test_subscriptions_are_queried_in_batches(self):
+        subscriptions = [f'subscription{index}' for index in range(RESOURCE_GRAPH_SUBSCRIPTIONS_BATCH_SIZE * 2 + 1)]
+
+        def resources(request):
+            # Every batch also returns a finding shared by all of them, which must be kept once.
+            data = [{'recommendationId': 'shared'}] + [{'recommendationId': subscription}
+                                                      for subscription in request.subscriptions]
+            return mock.MagicMock(data=data, skip_token=None)
+
+        client = mock.MagicMock()
+        client.resources.side_effect = resources
+        with mock.patch('azure.mgmt.resourcegraph.ResourceGraphClient', return_value=client):
+            findings = DefenderForCloud(None, subscriptions).get_findings(frameworks=['Azure CIS 1.1.0'])
+        batches = sorted((call[0][0].subscriptions for call in client.resources.call_args_list), key=len, reverse=True)
+        self.assertEqual([len(batch) for batch in batches],
+                         [RESOURCE_GRAPH_SUBSCRIPTIONS_BATCH_SIZE, RESOURCE_GRAPH_SUBSCRIPTIONS_BATCH_SIZE, 1])
+        self.assertEqual(sorted(chain.from_iterable(batches)), sorted(subscriptions))
+        recommendation_ids = [finding.recommendation_id for finding in findings]
+        self.assertEqual(sorted(recommendation_ids), sorted(subscriptions + ['shared']))
+
+
+class TestFindingFilters(TestCase):
+
+    def setUp(self):
+        self.findings = [SimpleNamespace(name='open', is_skipped=False, state='unhealthy'),
+                         SimpleNamespace(name='skipped', is_skipped=True, state='unhealthy'),
+                         SimpleNamespace(name='healthy', is_skipped=False, state='healthy')]
+
+    def test_filters(self):
+        get_names = partial(map, attrgetter('name'))
+        self.assertEqual(list(get_names(FindingParserLabeler.get_not_skipped_findings(self.findings))), ['open', 'healthy'])
+        self.assertEqual(list(get_names(FindingParserLabeler.exclude_findings_by_state(self.findings, ['healthy']))),
+                         ['open', 'skipped'])
+        self.assertEqual(list(get_names(FindingParserLabeler.filter_findings(self.findings, ['healthy']))), ['open'])
+        self.assertIsInstance(FindingParserLabeler.filter_findings(self.findings), list)
+
+    def test_filters_are_lazy(self):
+        consumed = []
+        findings = (consumed.append(finding) or finding for finding in self.findings)
+        not_skipped_findings = FindingParserLabeler.get_not_skipped_findings(findings)
+        self.assertEqual(consumed, [])
+        self.assertEqual(next(FindingParserLabeler.exclude_findings_by_state(not_skipped_findings, ['healthy'])).name, 'open')
+        self.assertEqual(consumed, self.findings[:1])
+
+
+class TestTenantEnergyLabel(TestCase):
+
+    @staticmethod
+    def get_tenant_label(labels):
+        subscriptions = [SimpleNamespace(subscription_id=f'subscription{index}',
+                                         get_energy_label=lambda findings, label=label: SimpleNamespace(label=label))
+                         for index, label in enumerate(labels)]
+        with mock.patch.object(Tenant, 'subscriptions', new_callable=mock.PropertyMock) as tenant_subscriptions:
+            tenant_subscriptions.return_value = subscriptions
+            return Tenant(None, 'tenant').get_energy_label(())
+
+    def test_tenant_thresholds(self):
+        self.assertEqual(self.get_tenant_label('AAAAAAAAAF'), TenantEnergyLabel('A', best_label='A', worst_label='F',
+                                                                                coverage='100.00%'))
+        for label, labels in (('B', 'AAAAAAAAFF'), ('B', 'AAAAABBFFF'), ('C', 'AAABBFFFFF'), ('D', 'ABCFFFFFFF'),
+                              ('E', 'AEFFFFFFFF'), ('F', 'AFFFFFFFFF'), ('F', 'FFFFFFFFFF')):
+            self.assertEqual(self.get_tenant_label(labels).label, label)